@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# vi: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# Micro-benchmarks for the libytest parsing stack. Run from the scripts/tests
+# directory, like:
+#   python3 -m libytest.benchmark prefilter <console log> [...]
+#   python3 -m libytest.benchmark throughput -s 1M,16M [--baseline old.json]
+
+import argparse
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from .mask import Mask, MaskEntry
+from .parse_console import Application
+from .parsers import error_parsers
+from .synthetic import ConsoleGenerator, parse_size
+from . import libytest as YT
+
+# The handler sets that the console parsers actually use.
+ERROR_TYPE_SETS = [
+    ('generic',),
+    ('python', 'generic'),
+    ('python', 'shell', 'boot', 'generic'),
+]
+
+
+def read_console(filepath):
+    with open(filepath, 'r', encoding='utf-8', errors='replace',
+              newline='') as fp_console:
+        return fp_console.read()
+
+def time_best_of(func, repeat, setup=None):
+    """Returns the best wall time of `repeat` calls of func(). If `setup` is
+    given, func() is called with the result of an (untimed) setup() call.
+    """
+    best = None
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_prefilter(args):
+    """Compares the line throughput of parse_errors() with and without the
+    keyword prefilter.
+    """
+    for filepath in args.console_file:
+        console = io.StringIO(read_console(filepath))
+        n_lines = sum(1 for _ in console)
+        print('{} ({} lines)'.format(filepath, n_lines))
+        print('  {:36} | {:>14} | {:>14} | {:>7}'.format(
+              'error types', 'regex lines/s', 'filter lines/s', 'speedup'))
+        for error_types in ERROR_TYPE_SETS:
+            results = []
+            for prefilter in (False, True):
+                elapsed = time_best_of(
+                    lambda: error_parsers.parse_errors(console, error_types,
+                                                       prefilter=prefilter),
+                    args.repeat)
+                results.append(n_lines / elapsed)
+            print('  {:36} | {:14.0f} | {:14.0f} | {:6.2f}x'.format(
+                  ','.join(error_types), results[0], results[1],
+                  results[1] / results[0]))
+    return 0
+
+
+def bench_memory(args):
+    """Reports the memory retained by the parsed element tree of each
+    console, per testcase.
+    """
+    config = SimpleNamespace(verbose=False, ptest_only=False)
+    print('  {:>9} | {:>12} | {:>12} | {:>14} | {}'.format(
+          'testcases', 'tree bytes', 'peak bytes', 'bytes/testcase',
+          'console'))
+    for filepath in args.console_file:
+        gc.collect()
+        tracemalloc.start()
+        e_suites = Application(config).parse_console_file(filepath)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        n_cases = sum(len(e_suite.test_cases)
+                      for e_suite in e_suites.test_suites)
+        print('  {:9} | {:12} | {:12} | {:14.0f} | {}'.format(
+              n_cases, retained, peak, retained / max(n_cases, 1), filepath))
+        del e_suites
+    return 0
+
+
+def make_mask(e_suites, n_entries):
+    """Returns a Mask of about `n_entries` entries, which match the failures
+    of some of the testcases in `e_suites`; one in four is a glob.
+    """
+    failing = [(e_suite, e_case) for e_suite in e_suites.test_suites
+               for e_case in e_suite.test_cases
+               if len(e_case.failures) + len(e_case.errors) > 0]
+    mask = Mask()
+    testcase_ids = set()
+    step = max(1, len(failing) // max(n_entries, 1))
+    for i, (e_suite, e_case) in enumerate(failing[::step][:n_entries]):
+        testcase_id = '%s:%s.%s' % (e_suite.get('name'),
+            e_case.get('classname'), e_case.get('name'))
+        if i % 4 == 3:
+            testcase_id = 'glob:%s:%s.*' % (e_suite.get('name'),
+                                       e_case.get('classname'))
+        if testcase_id not in testcase_ids:
+            testcase_ids.add(testcase_id)
+            mask.mask_entries.append(MaskEntry(testcase_id, 'all', '.*'))
+    return mask
+
+def bench_throughput(args):
+    """Times each stage of the parsing stack over synthetic consoles of each
+    of the `sizes`, and over any given console files. With a `baseline`
+    results file, fails if any stage lost more than `tolerance` of its
+    throughput.
+    """
+    config = SimpleNamespace(verbose=False, ptest_only=False)
+    results = {}
+    print('  {:>10} | {:>9} | {:>15} | {:>9} | {:>10} | {}'.format(
+          'console', 'MiB', 'stage', 'seconds', 'MiB/s', 'items/s'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        consoles = []
+        for size in args.sizes:
+            filepath = os.path.join(tmp_dir, 'synthetic-%d.log' % size)
+            ConsoleGenerator(args.seed).write_file(filepath, size)
+            consoles.append(('synth-%s' % format_size(size), filepath))
+        consoles.extend((os.path.basename(fp), fp) for fp in args.console_file)
+
+        for label, filepath in consoles:
+            results[label] = bench_console(config, filepath, args)
+            for stage, (elapsed, n_bytes, n_items) in results[label].items():
+                print('  {:>10} | {:9.1f} | {:>15} | {:9.3f} | {:10.1f} | '
+                      '{:.0f}'.format(label, n_bytes / 2**20, stage, elapsed,
+                                      n_bytes / 2**20 / elapsed,
+                                      n_items / elapsed))
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as fp:
+            return compare_throughput(json.load(fp), results, args.tolerance)
+    return 0
+
+def bench_console(config, filepath, args):
+    """Returns a {stage: (best seconds, bytes, items)} dict of the stages of
+    parsing the console at `filepath`.
+    """
+    stages = {}
+    n_bytes = os.path.getsize(filepath)
+    app = Application(config)
+
+    elapsed = time_best_of(lambda: app.parse_console_file(filepath),
+                           args.repeat)
+    e_suites = app.parse_console_file(filepath)
+    n_cases = sum(len(e_suite.test_cases) for e_suite in e_suites.test_suites)
+    stages['parse_console'] = (elapsed, n_bytes, n_cases)
+
+    console = io.StringIO(read_console(filepath))
+    n_lines = sum(1 for _ in console)
+    elapsed = time_best_of(lambda: error_parsers.parse_errors(console,
+        ['python', 'shell', 'boot', 'generic']), args.repeat)
+    stages['parse_errors'] = (elapsed, n_bytes, n_lines)
+
+    # masking modifies the testcases, so every run masks a fresh copy
+    mask = make_mask(e_suites, args.mask_entries)
+    packed = YT.pack_testsuites(e_suites)
+    elapsed = time_best_of(mask.mask_expectations, args.repeat,
+                           setup=lambda: YT.unpack_testsuites(packed))
+    stages['mask'] = (elapsed, n_bytes, n_cases)
+
+    with open(os.devnull, 'wb') as fp_null:
+        elapsed = time_best_of(
+            lambda: YT.write_xml_stream(e_suites, fp_null), args.repeat)
+    stages['write_xml'] = (elapsed, n_bytes, n_cases)
+    return stages
+
+def compare_throughput(baseline, results, tolerance):
+    """Prints the stages whose throughput dropped by more than `tolerance`
+    since `baseline`. Returns the number of such regressions.
+    """
+    regressions = 0
+    for label, stages in results.items():
+        for stage, (elapsed, n_bytes, _) in stages.items():
+            try:
+                base_elapsed, base_bytes, _ = baseline[label][stage]
+            except KeyError:
+                continue
+            ratio = (n_bytes / elapsed) / (base_bytes / base_elapsed)
+            if ratio < 1 - tolerance:
+                print('REGRESSION: {} {}: {:.0%} of the baseline '
+                      'throughput'.format(label, stage, ratio))
+                regressions += 1
+    return regressions
+
+def format_size(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= 1024 ** 'KMG'.index(unit) * 1024 and \
+           size % (1024 ** ('KMG'.index(unit) + 1)) == 0:
+            return '%d%s' % (size // 1024 ** ('KMG'.index(unit) + 1), unit)
+    return str(size)
+
+
+BENCHMARKS = {
+    'memory': bench_memory,
+    'prefilter': bench_prefilter,
+    'throughput': bench_throughput,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--baseline', action='store',
+                        help='throughput: fail on regressions against this results file.')
+    parser.add_argument('--mask-entries', action='store', type=int, default=200,
+                        help='throughput: number of entries in the benchmark mask.')
+    parser.add_argument('-o', '--output', action='store',
+                        help='throughput: write the results to this JSON file.')
+    parser.add_argument('-r', '--repeat', action='store', type=int, default=3,
+                        help='Report the best of this many runs.')
+    parser.add_argument('-s', '--sizes', action='store',
+                        type=lambda text: [parse_size(size) for size in text.split(',')],
+                        default=[parse_size('1M'), parse_size('8M')],
+                        help='throughput: comma-separated sizes of the synthetic consoles (default: 1M,8M).')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='throughput: random seed of the synthetic consoles.')
+    parser.add_argument('--tolerance', action='store', type=float, default=0.1,
+                        help='throughput: fraction of throughput which may be lost against the baseline.')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS.keys()),
+                        help='Benchmark to run.')
+    parser.add_argument('console_file', nargs='*',
+                        help='Console log(s) to benchmark against.')
+    args = parser.parse_intermixed_args()
+    if not args.console_file and args.benchmark != 'throughput':
+        parser.error('the %s benchmark needs console files' % args.benchmark)
+
+    sys.exit(BENCHMARKS[args.benchmark](args))
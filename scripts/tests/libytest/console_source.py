@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# vi: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# Read-only, memory-mapped console logs. A ConsoleSource maps a console file
+# into memory once; ConsoleViews are windows onto that mapping which behave
+# like read-only text streams, so that the parsers can walk segments of a
+# large console without copying them into io.StringIO buffers.
+
+import hashlib
+import mmap
+
+ENCODING = 'utf-8'
+ENCODING_ERRORS = 'replace'
+COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class ConsoleSource():
+    """A console log file, memory-mapped for reading."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._fp = open(filepath, 'rb')
+        try:
+            self._buffer = mmap.mmap(self._fp.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            self._buffer = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b''
+        self._fp.close()
+
+    def digest(self):
+        """Returns the hex SHA-256 digest of the console's content."""
+        return hashlib.sha256(self._buffer).hexdigest()
+
+    def view(self, start=0, end=None):
+        return ConsoleView(self._buffer, start, end)
+
+
+class ConsoleView():
+    """A read-only text stream over the [start, end) byte range of a console
+    buffer. Lines are split on '\\n' and decoded only as they are read. All
+    offsets given to and returned by `seek()` and `tell()` are byte offsets
+    relative to the start of the view.
+    """
+
+    def __init__(self, buffer, start=0, end=None):
+        self._buffer = buffer
+        if end is None or end > len(buffer):
+            end = len(buffer)
+        self.start = min(start, end)
+        self.end = end
+        self._pos = self.start
+
+    def __iter__(self):
+        return self
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def count_lines(self):
+        """Returns the number of lines in the view, without decoding it."""
+        n_lines = 0
+        for pos in range(self.start, self.end, COUNT_CHUNK_SIZE):
+            end = min(pos + COUNT_CHUNK_SIZE, self.end)
+            n_lines += self._buffer[pos:end].count(b'\n')
+        # a trailing partial line is still a line
+        if self.end > self.start \
+           and self._buffer[self.end - 1:self.end] != b'\n':
+            n_lines += 1
+        return n_lines
+
+    def _decode(self, start, end):
+        return self._buffer[start:end].decode(ENCODING, ENCODING_ERRORS)
+
+    def iter_lines(self):
+        """Yields a (start, end, line) tuple for every line in the view, where
+        start and end are absolute offsets into the underlying buffer. Does
+        not move the stream position.
+        """
+        buffer = self._buffer
+        end = self.end
+        pos = self.start
+        while pos < end:
+            eol = buffer.find(b'\n', pos, end)
+            eol = end if eol < 0 else eol + 1
+            yield pos, eol, buffer[pos:eol].decode(ENCODING, ENCODING_ERRORS)
+            pos = eol
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = self.end
+        else:
+            end = min(self._pos + size, self.end)
+        text = self._decode(self._pos, end)
+        self._pos = end
+        return text
+
+    def readline(self):
+        if self._pos >= self.end:
+            return ''
+        eol = self._buffer.find(b'\n', self._pos, self.end)
+        eol = self.end if eol < 0 else eol + 1
+        line = self._decode(self._pos, eol)
+        self._pos = eol
+        return line
+
+    def readlines(self):
+        lines = [line for _, _, line in self.view(self._pos).iter_lines()]
+        self._pos = self.end
+        return lines
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.tell()
+        elif whence == 2:
+            offset += len(self)
+        self._pos = self.start + max(0, min(offset, len(self)))
+        return self.tell()
+
+    def tell(self):
+        return self._pos - self.start
+
+    def view(self, start, end=None):
+        """Returns a sub-view of the underlying buffer. Unlike seek() and
+        tell(), `start` and `end` are absolute buffer offsets.
+        """
+        if end is None or end > self.end:
+            end = self.end
+        return ConsoleView(self._buffer, max(start, self.start), end)
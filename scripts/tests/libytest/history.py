@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# vi: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# A local history of test results. Every recorded run appends the outcome and
+# duration of each of its testsuites and testcases to an SQLite database,
+# which can then be queried for duration quantiles and failure rates; eg. to
+# schedule suites, choose timeouts or spot flaky tests.
+
+from collections import namedtuple
+import sqlite3
+import time
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    recorded    REAL NOT NULL,
+    console     TEXT,
+    variant     TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS suite_results (
+    run_id      INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    suite       TEXT NOT NULL,
+    tests       INTEGER NOT NULL,
+    failures    INTEGER NOT NULL,
+    errors      INTEGER NOT NULL,
+    skipped     INTEGER NOT NULL,
+    duration    REAL,
+    timestamp   REAL
+);
+CREATE INDEX IF NOT EXISTS suite_results_suite
+    ON suite_results (suite, run_id);
+CREATE TABLE IF NOT EXISTS case_results (
+    run_id      INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    suite       TEXT NOT NULL,
+    classname   TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    outcome     TEXT NOT NULL,
+    duration    REAL
+);
+CREATE INDEX IF NOT EXISTS case_results_case
+    ON case_results (suite, classname, name, run_id);
+CREATE TABLE IF NOT EXISTS timeout_overruns (
+    recorded    REAL NOT NULL,
+    suite       TEXT NOT NULL,
+    variant     TEXT NOT NULL DEFAULT '',
+    timeout     REAL NOT NULL
+);
+'''
+
+OUTCOME_PASS = 'pass'
+OUTCOME_FAIL = 'fail'
+OUTCOME_ERROR = 'error'
+OUTCOME_SKIP = 'skip'
+
+SuiteStats = namedtuple('SuiteStats', ['runs', 'p50', 'p95', 'failure_rate'])
+
+
+def quantile(values, q):
+    """Returns the `q` quantile (0 <= q <= 1) of the sorted sequence `values`,
+    interpolating linearly between the closest ranks; None if it is empty.
+    """
+    if not values:
+        return None
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def testcase_outcome(e_case):
+    if e_case.errors:
+        return OUTCOME_ERROR
+    if e_case.failures:
+        return OUTCOME_FAIL
+    if e_case.skipped:
+        return OUTCOME_SKIP
+    return OUTCOME_PASS
+
+
+class HistoryStore():
+    """An SQLite database of past testsuite and testcase results.
+
+    `variant` strings distinguish runs whose durations are not comparable;
+    eg. the same suites run on VMs of different sizes. Queries which are
+    given a variant only consider the runs of that variant.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise RuntimeError('%s has an unsupported history schema (%d)' %
+                               (path, version))
+        with self.db:
+            self.db.executescript(SCHEMA)
+            self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def record(self, e_suites, console=None, variant='', recorded=None):
+        """Appends the results of the TestSuites `e_suites` as a new run.
+
+        Suite durations are taken from each TestSuite's `wall_time`, as
+        measured when the console was parsed; the 'time' attribute is only
+        the sum of the testcase times.
+
+        Returns: the id of the new run
+        """
+        if recorded is None:
+            recorded = time.time()
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (recorded, console, variant) VALUES (?, ?, ?)',
+                (recorded, console, variant or ''))
+            run_id = cursor.lastrowid
+
+            suite_rows = []
+            case_rows = []
+            for e_suite in e_suites.test_suites:
+                e_suite.eval_counts()
+                suite_name = e_suite.get('name')
+                suite_rows.append((run_id, suite_name,
+                    e_suite.get('tests'), e_suite.get('failures'),
+                    e_suite.get('errors'), e_suite.get('skipped'),
+                    e_suite.wall_time, e_suite.get('timestamp') or None))
+                for e_case in e_suite.test_cases:
+                    case_rows.append((run_id, suite_name,
+                        e_case.get('classname'), e_case.get('name'),
+                        testcase_outcome(e_case), e_case.get('time')))
+            self.db.executemany(
+                'INSERT INTO suite_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                suite_rows)
+            self.db.executemany(
+                'INSERT INTO case_results VALUES (?, ?, ?, ?, ?, ?)',
+                case_rows)
+        return run_id
+
+    def record_timeout_overrun(self, suite, timeout, variant='',
+                               recorded=None):
+        """Records that `suite` did not finish within `timeout` seconds."""
+        if recorded is None:
+            recorded = time.time()
+        with self.db:
+            self.db.execute('INSERT INTO timeout_overruns VALUES (?, ?, ?, ?)',
+                            (recorded, suite, variant or '', timeout))
+
+    def timeout_overruns(self, suite=None, variant=None):
+        """Returns a list of (recorded, suite, variant, timeout) tuples of the
+        recorded timeout overruns, oldest first.
+        """
+        query = 'SELECT * FROM timeout_overruns WHERE 1'
+        args = []
+        if suite is not None:
+            query += ' AND suite = ?'
+            args.append(suite)
+        if variant is not None:
+            query += ' AND variant = ?'
+            args.append(variant)
+        return self.db.execute(query + ' ORDER BY recorded', args).fetchall()
+
+    def _recent_suite_rows(self, columns, suite, variant, limit):
+        query = ('SELECT %s FROM suite_results JOIN runs ON runs.id = run_id'
+                 ' WHERE suite = ?' % columns)
+        args = [suite]
+        if variant is not None:
+            query += ' AND variant = ?'
+            args.append(variant)
+        query += ' ORDER BY run_id DESC'
+        if limit:
+            query += ' LIMIT ?'
+            args.append(limit)
+        return self.db.execute(query, args).fetchall()
+
+    def suite_durations(self, suite, variant=None, limit=None):
+        """Returns the sorted, known durations of `suite`, over its `limit`
+        most recent runs.
+        """
+        rows = self._recent_suite_rows('duration', suite, variant, limit)
+        return sorted(row[0] for row in rows if row[0] is not None)
+
+    def duration_quantiles(self, suite, quantiles=(0.5, 0.95), variant=None,
+                           limit=None):
+        """Returns a {q: seconds} dict of the duration quantiles of `suite`.
+        The values are None if it has no recorded durations.
+        """
+        durations = self.suite_durations(suite, variant, limit)
+        return {q: quantile(durations, q) for q in quantiles}
+
+    def failure_rate(self, suite, classname=None, name=None, variant=None,
+                     limit=None):
+        """Returns the fraction of the recent runs of `suite` (or of one of
+        its testcases, if `classname` and `name` are given) which failed or
+        errored; None if there are no such runs. Skipped testcases are not
+        counted.
+        """
+        if classname is None:
+            rows = self._recent_suite_rows('failures + errors', suite,
+                                           variant, limit)
+            outcomes = [row[0] > 0 for row in rows]
+        else:
+            query = ('SELECT outcome FROM case_results'
+                     ' JOIN runs ON runs.id = run_id'
+                     ' WHERE suite = ? AND classname = ? AND name = ?'
+                     ' AND outcome != ?')
+            args = [suite, classname, name, OUTCOME_SKIP]
+            if variant is not None:
+                query += ' AND variant = ?'
+                args.append(variant)
+            query += ' ORDER BY run_id DESC'
+            if limit:
+                query += ' LIMIT ?'
+                args.append(limit)
+            outcomes = [row[0] != OUTCOME_PASS
+                        for row in self.db.execute(query, args)]
+        if not outcomes:
+            return None
+        return sum(outcomes) / len(outcomes)
+
+    def suite_stats(self, suite, variant=None, limit=None):
+        rows = self._recent_suite_rows('duration, failures + errors', suite,
+                                       variant, limit)
+        durations = sorted(row[0] for row in rows if row[0] is not None)
+        failure_rate = None
+        if rows:
+            failure_rate = sum(row[1] > 0 for row in rows) / len(rows)
+        return SuiteStats(len(rows), quantile(durations, 0.5),
+                          quantile(durations, 0.95), failure_rate)
+
+    def suites(self, variant=None):
+        """Returns the names of every suite in the history."""
+        query = 'SELECT DISTINCT suite FROM suite_results'
+        args = []
+        if variant is not None:
+            query += ' JOIN runs ON runs.id = run_id WHERE variant = ?'
+            args.append(variant)
+        return sorted(row[0] for row in self.db.execute(query, args))
+
+    def flaky_testcases(self, suite=None, variant=None, limit=None,
+                        min_runs=2):
+        """Returns a list of (suite, classname, name, failure rate) tuples of
+        the testcases which have both passed and failed in their `limit` most
+        recent runs (of `variant`), most flaky first. Only the testcases
+        with at least `min_runs` such runs, not counting skips, are
+        considered.
+        """
+        # rank the runs of each testcase, most recent first, as
+        # failure_rate() counts them
+        query = ('WITH recent AS (SELECT suite, classname, name, outcome,'
+                 ' ROW_NUMBER() OVER (PARTITION BY suite, classname, name'
+                 ' ORDER BY run_id DESC) AS rank'
+                 ' FROM case_results JOIN runs ON runs.id = run_id'
+                 ' WHERE outcome != ?')
+        args = [OUTCOME_SKIP]
+        if suite is not None:
+            query += ' AND suite = ?'
+            args.append(suite)
+        if variant is not None:
+            query += ' AND variant = ?'
+            args.append(variant)
+        query += (') SELECT suite, classname, name, AVG(outcome != ?) AS rate'
+                  ' FROM recent')
+        args.append(OUTCOME_PASS)
+        if limit:
+            query += ' WHERE rank <= ?'
+            args.append(limit)
+        query += (' GROUP BY suite, classname, name'
+                  ' HAVING COUNT(*) >= ? AND rate > 0 AND rate < 1'
+                  ' ORDER BY MIN(rate, 1 - rate) DESC, suite, classname, name')
+        args.append(min_runs)
+        return self.db.execute(query, args).fetchall()
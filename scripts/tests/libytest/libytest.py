@@ -10,9 +10,29 @@
 # [2] https://raw.githubusercontent.com/bluebird75/luaunit/master/junitxml/junit-jenkins.xsd
 
 from collections import OrderedDict
-from copy import deepcopy
 import datetime
-import lxml.etree as ET
+import importlib
+import json
+import pickle
+import re
+
+
+class _LazyModule():
+    """A module which is only imported once one of its attributes is first
+    used; so that the element classes can be used without loading lxml, when
+    no xml is written.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+ET = _LazyModule('lxml.etree')
 
 ISOFORMAT = "%Y-%m-%dT%H:%M:%S"
 STATUS = {
@@ -21,6 +41,11 @@ STATUS = {
     'SKIP': ('S', 'SKIP', 'SKIPPED'),
 }
 
+# Characters outside of the xml1.0 charset: the C0 controls (except tab and
+# newline, optionally), lone surrogates, and the U+FFFE/U+FFFF noncharacters.
+RE_XML_INVALID = re.compile('[\x00-\x08\x0b-\x1f\ud800-\udfff\ufffe\uffff]')
+RE_XML_INVALID_NO_NEWLINES = re.compile('[\x00-\x1f\ud800-\udfff\ufffe\uffff]')
+
 
 #================#
 # MODULE METHODS #
@@ -69,14 +94,59 @@ def sanitize_str_xml(text, no_newlines=False):
     NULL characters, ASCII control characters (except newline), etc.
     text : str input text
     """
-    def is_valid_xml_char(c):
-        c = ord(c)
-        if not no_newlines and c in (0x9, 0xA):
-            return True
-        else:
-            return (0x20 <= c <= 0xD7FF
-                    or 0xE000 <= c <= 0xFFFD or 0x10000 <= c <= 0x10FFFF)
-    return ''.join(char for char in text if is_valid_xml_char(char))
+    regex = RE_XML_INVALID_NO_NEWLINES if no_newlines else RE_XML_INVALID
+    # Most text is already clean; searching for an invalid character is much
+    # cheaper than rebuilding the string.
+    if regex.search(text) is None:
+        return text
+    return regex.sub('', text)
+
+def pack_testsuites(e_suites):
+    """Returns a compact, picklable bytes representation of a TestSuites
+    element tree; for moving parse results between processes.
+    """
+    return pickle.dumps(e_suites._pack(), protocol=pickle.HIGHEST_PROTOCOL)
+
+def unpack_testsuites(data):
+    """Rebuilds a TestSuites element tree from `pack_testsuites()` bytes."""
+    return TestSuites._unpack(pickle.loads(data))
+
+def pack_testsuite(e_suite):
+    """Like `pack_testsuites()`, for a single TestSuite."""
+    return pickle.dumps(e_suite._pack(), protocol=pickle.HIGHEST_PROTOCOL)
+
+def unpack_testsuite(data):
+    """Rebuilds a TestSuite element from `pack_testsuite()` bytes."""
+    return TestSuite._unpack(pickle.loads(data))
+
+def dump_testsuites_json(e_suites):
+    """Returns the packed form of a TestSuites element tree as JSON bytes.
+    Unlike `pack_testsuites()`, these are safe to load from storage which
+    others may write to.
+    """
+    return json.dumps(e_suites._pack(), separators=(',', ':')).encode()
+
+def load_testsuites_json(data):
+    """Rebuilds a TestSuites element tree from `dump_testsuites_json()`
+    bytes. Raises ValueError if they do not hold a packed TestSuites.
+    """
+    packed = json.loads(data)
+    try:
+        TestSuites._check_packed(packed)
+    except (KeyError, TypeError) as e:
+        raise ValueError('malformed packed TestSuites: %r' % e)
+    return TestSuites._unpack(packed)
+
+def _packed_items(packed, n_items=None):
+    """Returns `packed` if it is a packed sequence (of `n_items` items)."""
+    if not isinstance(packed, (list, tuple)) \
+       or (n_items is not None and len(packed) != n_items):
+        raise ValueError('malformed packed element')
+    return packed
+
+def _check_packed_value(value, *types):
+    if not isinstance(value, types):
+        raise ValueError('malformed packed value: %r' % (value,))
 
 def _status_handler(value):
     value = value.upper()
@@ -103,6 +173,35 @@ def write_xml(e_suites, fp_out, verbose=False):
                              #encoding='utf-8', pretty_print=True))
     fp_out.write(suites_to_string(e_suites, verbose))
 
+def write_xml_stream(e_suites, fp_out, verbose=False):
+    """Writes the same document as `write_xml()`, but serializes one testsuite
+    at a time through an lxml.etree.xmlfile, so that only a single testsuite's
+    lxml tree and serialized bytes are held in memory at once. The root counts
+    are computed before anything is written.
+    """
+    _write_xml_header(fp_out)
+    fp_out.flush()
+
+    e_suites.eval_counts()
+    attrs = e_suites.get_xml_attrs(verbose)
+    if len(e_suites.test_suites) == 0:
+        fp_out.write(ET.tostring(ET.Element(e_suites.TAG, attrs),
+                                 encoding='utf-8', pretty_print=True))
+        return
+
+    with ET.xmlfile(fp_out, encoding='utf-8', close=False) as xf:
+        with xf.element(e_suites.TAG, attrs):
+            for e_suite in e_suites.test_suites:
+                # indent each testsuite as pretty_print would, as a child of
+                # the root element
+                e_xml = e_suite.get_xml_element(verbose)
+                ET.indent(e_xml, space='  ', level=1)
+                xf.write('\n  ')
+                xf.write(e_xml)
+                xf.flush()
+            xf.write('\n')
+    fp_out.write(b'\n')
+
 def _write_xml_header(fp_out):
     fp_out.write(b'<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n')
 
@@ -113,36 +212,42 @@ def _write_xml_header(fp_out):
 
 
 class Spec():
+    """The schema of a single element attribute. Specs are shared by every
+    instance of an Element class and are never modified; the attribute
+    values themselves are stored on the element instances.
+    """
+
+    __slots__ = ('default_value', 'required', 'str_handler', 'type_handler')
+
     def __init__(self, type_handler, is_required, default_value,
                  str_handler=None):
         self.default_value = default_value
         self.required = bool(is_required)
         self.str_handler = str_handler
         self.type_handler = type_handler
-        self.value = None
 
-    def get(self):
-        if self.value is not None:
-            return self.value
+    def get(self, value):
+        if value is not None:
+            return value
         else:
             return self.default_value
 
-    def satisfied(self):
+    def satisfied(self, value):
         if not self.required:
             return True
-        elif self.value is not None:
+        elif value is not None:
             return True
         else:
             return False
 
-    def set(self, value):
-        self.value = self.type_handler(value)
+    def coerce(self, value):
+        return self.type_handler(value)
 
-    def __str__(self):
+    def to_str(self, value):
         try:
-            return self.str_handler(self.get())
+            return self.str_handler(self.get(value))
         except TypeError:
-            return str(self.get())
+            return str(self.get(value))
 
 
 #===============#
@@ -163,12 +268,105 @@ class DatetimeWrapper(datetime.datetime):
         return super().__new__(*args, **kwargs)
 
 
+class ElementList(list):
+    """A list of child elements which keeps the aggregate counts of its owner
+    element current. Appended elements are reported to the owner through
+    `_children_added()`; any other modification invalidates the owner's
+    counts. If `adopt` is asserted, elements added to the list also record the
+    owner as their parent, so that their own changes invalidate the owner's
+    counts.
+    """
+
+    __slots__ = ('_owner', '_adopt')
+
+    def __init__(self, owner, items=(), adopt=False):
+        super().__init__(items)
+        self._owner = owner
+        self._adopt = adopt
+        if adopt:
+            for item in self:
+                item._parent = owner
+
+    def _added(self, items):
+        if self._adopt:
+            for item in items:
+                item._parent = self._owner
+        self._owner._children_added(items)
+
+    def _changed(self, items=()):
+        if self._adopt:
+            for item in items:
+                item._parent = self._owner
+        self._owner._invalidate()
+
+    def append(self, item):
+        super().append(item)
+        self._added((item,))
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def extend(self, items):
+        items = list(items)
+        super().extend(items)
+        self._added(items)
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._added((item,))
+
+    def pop(self, *args):
+        item = super().pop(*args)
+        self._changed()
+        return item
+
+    def remove(self, item):
+        super().remove(item)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = list(value)
+            super().__setitem__(key, value)
+            self._changed(value)
+        else:
+            super().__setitem__(key, value)
+            self._changed((value,))
+
+
 class Element():
+    """Base class of the xml elements.
+
+    Subclasses declare their attribute schema as a class-level ATTRS dict of
+    Spec objects. Each instance stores only the values of the attributes which
+    have been explicitly set, in a list ordered like ATTRS which is allocated
+    on the first set(); unset attributes read as their Spec default.
+    """
+
+    __slots__ = ('_values',)
+
+    ATTRS = {}
+    # Attributes which, when set, invalidate aggregate counts.
+    COUNTED_ATTRS = frozenset()
+    _ATTR_INDEX = {}
+    _ATTR_SPECS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._ATTR_INDEX = {attr: i for i, attr in enumerate(cls.ATTRS)}
+        cls._ATTR_SPECS = tuple(cls.ATTRS.items())
 
     def __init__(self, *args, **kwargs):
-        # deepcopy the ATTR specs so that they can be modified by this
-        # instance.
-        self.ATTRS = deepcopy(self.ATTRS)
+        self._values = None
 
         for key, value in kwargs.items():
             try:
@@ -176,22 +374,80 @@ class Element():
             except KeyError:
                 pass
 
+    def _attr_index(self, attr):
+        try:
+            return self._ATTR_INDEX[attr]
+        except KeyError:
+            raise KeyError("'{}' is not a defined attribute of {}".format(attr,
+                           type(self)))
+
     def get(self, attr):
-        return self.ATTRS[attr].get()
+        value = None
+        if self._values is not None:
+            value = self._values[self._ATTR_INDEX[attr]]
+        if value is None:
+            return self.ATTRS[attr].default_value
+        return value
+
+    def _pack_attrs(self):
+        # Only explicitly-set attribute values are packed. They have already
+        # passed through their type handlers, so _unpack_attrs() can restore
+        # them verbatim.
+        if self._values is None:
+            return ()
+        return tuple((attr, value) for (attr, _), value
+                     in zip(self._ATTR_SPECS, self._values)
+                     if value is not None)
+
+    def _unpack_attrs(self, attrs):
+        for attr, value in attrs:
+            self._set_value(self._ATTR_INDEX[attr], value)
+
+    @classmethod
+    def _check_packed_attrs(cls, attrs):
+        # packed values have passed through their type handlers, which give
+        # them the type of their defaults
+        for item in _packed_items(attrs):
+            attr, value = _packed_items(item, 2)
+            spec = cls.ATTRS[attr]
+            _check_packed_value(value, type(spec.default_value))
+
+    def _set_value(self, index, value):
+        if self._values is None:
+            self._values = [None] * len(self._ATTR_SPECS)
+        self._values[index] = value
 
     def get_children(self):
         return []
 
-    def get_xml_element(self, verbose=False):
+    def _children_added(self, items):
+        """Called when `items` are appended to one of this element's
+        ElementLists.
+        """
+        self._invalidate()
+
+    def _invalidate(self):
+        """Called whenever a change to this element could change the aggregate
+        counts of it or of its parents.
+        """
+        pass
+
+    def get_xml_attrs(self, verbose=False):
+        """Returns the dict of xml attribute strings of this element."""
         attrs = {}
-        for attr, spec in self.ATTRS.items():
-            if not spec.satisfied():
+        values = self._values or (None,) * len(self._ATTR_SPECS)
+        for (attr, spec), value in zip(self._ATTR_SPECS, values):
+            if not spec.satisfied(value):
                 raise RuntimeError("{} ({}) attribute: '{}' is required but "
                                    "unset.".format(self.TAG, id(self), attr))
-            if not verbose and spec.value is None:
+            if not verbose and value is None:
                 continue
             else:
-                attrs[attr] = str(spec)
+                attrs[attr] = spec.to_str(value)
+        return attrs
+
+    def get_xml_element(self, verbose=False):
+        attrs = self.get_xml_attrs(verbose)
 
         try:
             e = ET.Element(self.TAG, attrs)
@@ -213,21 +469,24 @@ class Element():
         return e
 
     def reset(self, attr):
-        try:
-            self.ATTRS[attr].set(self.ATTRS[attr].default_value)
-        except KeyError:
-            raise KeyError("'{}' is not a defined attribute of {}".format(attr,
-                           type(self)))
+        index = self._attr_index(attr)
+        spec = self._ATTR_SPECS[index][1]
+        self._set_value(index, spec.coerce(spec.default_value))
+        if attr in self.COUNTED_ATTRS:
+            self._invalidate()
 
     def set(self, attr, value):
         if isinstance(value, str):
             value = sanitize_str_xml(value, no_newlines=False)
 
-        try:
-            self.ATTRS[attr].set(value)
-        except KeyError:
-            raise KeyError("'{}' is not a defined attribute of {}".format(attr,
-                           type(self)))
+        index = self._attr_index(attr)
+        self._set_value(index, self._ATTR_SPECS[index][1].coerce(value))
+        if attr in self.COUNTED_ATTRS:
+            self._invalidate()
+
+    def _set_count(self, attr, value):
+        # sets a computed count, without invalidating
+        self._set_value(self._ATTR_INDEX[attr], value)
 
     def __str__(self):
         return ET.tostring(self.get_xml_element(), encoding=str)
@@ -240,6 +499,8 @@ class Element():
 
 class CData(Element):
 
+    __slots__ = ('__text', '__appends')
+
     ATTRS={}
 
     def __init__(self, text="", **kwargs):
@@ -250,6 +511,23 @@ class CData(Element):
         e = super().get_xml_element(verbose)
         return e
 
+    def _pack(self):
+        return (self._pack_attrs(), self.text)
+
+    @classmethod
+    def _unpack(cls, packed):
+        e = cls.__new__(cls)
+        CData.__init__(e)
+        e._unpack_attrs(packed[0])
+        e.__text = packed[1]  # already sanitized
+        return e
+
+    @classmethod
+    def _check_packed(cls, packed):
+        attrs, text = _packed_items(packed, 2)
+        cls._check_packed_attrs(attrs)
+        _check_packed_value(text, str)
+
     def formatted_text(self):
         if len(self.text) > 0:
             return ET.CDATA(self.text)
@@ -258,18 +536,34 @@ class CData(Element):
 
     @property
     def text(self):
-        if self.__text is None:
-            return ""
-        else:
-            return self.__text
+        # The text is kept sanitized; appended text is sanitized as it is
+        # added and only joined when the text is next read.
+        if self.__appends is not None:
+            self.__text += ''.join(self.__appends)
+            self.__appends = None
+        return self.__text
 
     @text.setter
     def text(self, value):
+        self.__appends = None
         if value is None:
             self.__text = ""
         else:
             self.__text = sanitize_str_xml(value)
 
+    def append(self, text):
+        """Appends `text` to this element's text, sanitizing only the new
+        text.
+        """
+        if text:
+            self._append_sanitized(sanitize_str_xml(text))
+
+    def _append_sanitized(self, text):
+        if self.__appends is None:
+            self.__appends = [text]
+        else:
+            self.__appends.append(text)
+
     def __add__(self, other):
         if isinstance(other, str):
             return type(self)(self.text + other)
@@ -279,14 +573,18 @@ class CData(Element):
 
     def __iadd__(self, other):
         if isinstance(other, str):
-            self.text = self.text + other
+            self.append(other)
         elif isinstance(other, CData):
-            self.text += other.text
+            # already sanitized
+            if other.text:
+                self._append_sanitized(other.text)
         return self
 
 
 class Error(CData):
 
+    __slots__ = ()
+
     TAG = "error"
     ATTRS = {
         'message': Spec(str, True, ""),
@@ -305,6 +603,8 @@ class Failure(CData):
        Failure elements indicates that a TestCase has 'FAIL'ed.
     """
 
+    __slots__ = ()
+
     TAG = 'failure'
     ATTRS = {
         'message': Spec(str, True, ""),  # The failing assertion or text
@@ -312,17 +612,20 @@ class Failure(CData):
     }
 
     def __init__(self, message, type_, text=None, *args, **kwargs):
-        kwargs['message'] = sanitize_str_xml(str(message))
+        kwargs['message'] = str(message)
         kwargs['type'] = str(type_)
         super().__init__(**kwargs)
 
 
 class Properties(Element):
 
+    __slots__ = ('_children',)
+
     TAG = "properties"
     ATTRS = {}
 
     def __init__(self, *args, **kwargs):
+        super().__init__()
         self._children = []
         for arg in args:
             if isinstance(arg, list):
@@ -338,6 +641,8 @@ class Properties(Element):
 
 class Property(Element):
 
+    __slots__ = ()
+
     TAG = "property"
     ATTRS = {\
         'name' : Spec(str, True, ""),
@@ -348,27 +653,52 @@ class Property(Element):
         kwargs['value'] = value
         super().__init__(*args, **kwargs)
 
+    def _pack(self):
+        return self._pack_attrs()
+
+    @classmethod
+    def _unpack(cls, packed):
+        e = cls.__new__(cls)
+        Element.__init__(e)
+        e._unpack_attrs(packed)
+        return e
+
+    @classmethod
+    def _check_packed(cls, packed):
+        cls._check_packed_attrs(packed)
+
 
 class Skipped(Element):
 
+    __slots__ = ()
+
     TAG = "skipped"
     ATTRS = {}
 
 
 class StdErr(CData):
 
+    __slots__ = ()
+
     TAG = "system-err"
     ATTRS = {}
 
 
 class StdOut(CData):
 
+    __slots__ = ()
+
     TAG = "system-out"
     ATTRS = {}
 
 
 class TestCase(Element):
 
+    # The child element lists are only allocated once they are first
+    # accessed; most testcases never have errors or stderr.
+    __slots__ = ('_errors', '_failures', '_skipped', '_stdouts', '_stderrs',
+                 '_children', '_parent')
+
     TAG = 'testcase'
     ATTRS = {\
         'assertions': Spec(int, False, 0),
@@ -377,14 +707,16 @@ class TestCase(Element):
         'status'    : Spec(_status_handler, False, 'FAIL'),
         'time'      : Spec(int, False, 0),
         }
+    COUNTED_ATTRS = frozenset(['time'])
 
     def __init__(self, *args, **kwargs):
+        self._parent = None
         super().__init__(self, *args, **kwargs)
-        self._errors = []
-        self._failures = []
+        self._errors = None
+        self._failures = None
         self._skipped = False
-        self._stdouts = []
-        self._stderrs = []
+        self._stdouts = None
+        self._stderrs = None
 
     def add_child(self, child):
         if isinstance(child, Error):
@@ -405,12 +737,20 @@ class TestCase(Element):
 
     @property
     def errors(self):
+        if self._errors is None:
+            self._errors = ElementList(self)
         return self._errors
 
     @property
     def failures(self):
+        if self._failures is None:
+            self._failures = ElementList(self)
         return self._failures
 
+    def _invalidate(self):
+        if self._parent is not None:
+            self._parent._invalidate()
+
     @property
     def skipped(self):
         return self._skipped
@@ -418,22 +758,60 @@ class TestCase(Element):
     @skipped.setter
     def skipped(self, value):
         self._skipped = bool(value)
+        self._invalidate()
 
     @property
     def stdouts(self):
+        if self._stdouts is None:
+            self._stdouts = []
         return self._stdouts
 
     @property
     def stderrs(self):
+        if self._stderrs is None:
+            self._stderrs = []
         return self._stderrs
 
     def eval_counts(self):
-        self.reset('assertions')
-        self.set('assertions', len(self.failures))
+        self._set_count('assertions', len(self._failures or ()))
+
+    def _pack(self):
+        return (self._pack_attrs(), self.skipped,
+                tuple(e._pack() for e in self._errors or ()),
+                tuple(e._pack() for e in self._failures or ()),
+                tuple(e._pack() for e in self._stdouts or ()),
+                tuple(e._pack() for e in self._stderrs or ()))
+
+    @classmethod
+    def _unpack(cls, packed):
+        attrs, skipped, errors, failures, stdouts, stderrs = packed
+        e = cls()
+        e._unpack_attrs(attrs)
+        e.skipped = skipped
+        if errors:
+            e.errors.extend(Error._unpack(x) for x in errors)
+        if failures:
+            e.failures.extend(Failure._unpack(x) for x in failures)
+        if stdouts:
+            e.stdouts.extend(StdOut._unpack(x) for x in stdouts)
+        if stderrs:
+            e.stderrs.extend(StdErr._unpack(x) for x in stderrs)
+        return e
+
+    @classmethod
+    def _check_packed(cls, packed):
+        attrs, skipped, errors, failures, stdouts, stderrs = \
+            _packed_items(packed, 6)
+        cls._check_packed_attrs(attrs)
+        _check_packed_value(skipped, bool)
+        for type_, items in ((Error, errors), (Failure, failures),
+                             (StdOut, stdouts), (StdErr, stderrs)):
+            for item in _packed_items(items):
+                type_._check_packed(item)
 
     def eval_status(self):
         status = 'PASS'
-        if len(self.failures) > 0:
+        if self._failures:
             status = 'FAIL'
         elif self.skipped:
             status = 'SKIP'
@@ -449,11 +827,11 @@ class TestCase(Element):
 
         # NOTE: the order of child elements here is strictly defined by the
         # schema. No; I don't know why.
-        for group in ['errors', 'failures']:
-            if verbose or len(getattr(self, group)) > 0:
+        for group in ['_errors', '_failures']:
+            if getattr(self, group):
                 self._children.extend(getattr(self, group))
-        for group in ['stdouts', 'stderrs']:
-            for item in getattr(self, group):
+        for group in ['_stdouts', '_stderrs']:
+            for item in getattr(self, group) or ():
                 # only print the std{out/err} if it is non-zero length or if
                 # verbose
                 if verbose or len(item.text) > 0:
@@ -463,6 +841,9 @@ class TestCase(Element):
 
 class TestSuite(Element):
 
+    __slots__ = ('_test_cases', 'properties', 'stdout', 'stderr', '_children',
+                 '_dirty', '_parent', 'wall_time')
+
     TAG = 'testsuite'
     ATTRS = {\
         'disabled' : Spec(int, False, 0),
@@ -477,10 +858,20 @@ class TestSuite(Element):
         'time'     : Spec(int, False, 0),
         'timestamp': Spec(int, False, 0, _str_timestamp),
         }
+    # The counts are computed from the testcases; setting any of them only
+    # lasts until the next eval_counts().
+    COUNTS = ('tests', 'errors', 'failures', 'skipped', 'time')
+    COUNTED_ATTRS = frozenset(COUNTS + ('disabled',))
 
     def __init__(self, *args, **kwargs):
+        self._dirty = True
+        self._parent = None
+        # The suite's duration in seconds, as measured from the console when
+        # it was parsed (or None). Unlike the 'time' attribute, it is not
+        # recomputed from the testcases; nor is it written to the xml.
+        self.wall_time = None
         super().__init__(self, *args, **kwargs)
-        self.test_cases = []
+        self._test_cases = ElementList(self, adopt=True)
         self.properties = []
         # Unlike TestCases, TestSuites are only supposed to have max 1 stdout &
         # stderr element.
@@ -488,35 +879,106 @@ class TestSuite(Element):
         self.stderr = StdErr()
         self.eval_counts()
 
+    @property
+    def test_cases(self):
+        return self._test_cases
+
+    @test_cases.setter
+    def test_cases(self, value):
+        self._test_cases = ElementList(self, value, adopt=True)
+        self._invalidate()
+
+    def _invalidate(self):
+        if not self._dirty:
+            self._dirty = True
+            if self._parent is not None:
+                self._parent._invalidate()
+
+    @staticmethod
+    def _case_counts(case):
+        """Returns the contribution of `case` to each of COUNTS."""
+        case.eval_counts()
+        return (1, int(bool(case._errors)), int(bool(case._failures)),
+                int(case.skipped), case.get('time'))
+
+    def _children_added(self, cases):
+        # New testcases are added to valid counts in place, and the change is
+        # passed up to the parent; there is no need for a recount.
+        if self._dirty:
+            return
+        delta = [0] * len(self.COUNTS)
+        for case in cases:
+            for i, count in enumerate(self._case_counts(case)):
+                delta[i] += count
+        delta = dict(zip(self.COUNTS, delta))
+        for attr, count in delta.items():
+            self._set_count(attr, self.get(attr) + count)
+        if self._parent is not None:
+            self._parent._suite_counts_changed(delta)
+
     def eval_counts(self):
-        self.reset('tests')
-        self.reset('errors')
-        self.reset('failures')
-        self.reset('skipped')
-        self.reset('time')
-        for case in self.test_cases:
-            case.eval_counts()
-            self.set('tests', self.get('tests') + 1)
-            if len(case.errors) > 0:
-                self.set('errors', self.get('errors') + 1)
-            if len(case.failures) > 0:
-                self.set('failures', self.get('failures') + 1)
-            self.set('skipped', self.get('skipped') + int(case.skipped))
-            self.set('time', self.get('time') + case.get('time'))
+        """Recomputes the aggregate counts from the testcases. The counts are
+        kept current as testcases are appended, and are only recounted after
+        a testcase has been removed or changed; so this is cheap to call
+        repeatedly.
+        """
+        if not self._dirty:
+            return
+        totals = [0] * len(self.COUNTS)
+        for case in self._test_cases:
+            for i, count in enumerate(self._case_counts(case)):
+                totals[i] += count
+        for attr, count in zip(self.COUNTS, totals):
+            self._set_count(attr, count)
+        self._dirty = False
+
+    def get_passed(self):
+        self.eval_counts()
+        return (self.get('tests') - self.get('failures') - self.get('skipped')
+                - self.get('disabled'))
+
+    def _pack(self):
+        return (self._pack_attrs(),
+                tuple(e._pack() for e in self.properties),
+                tuple(e._pack() for e in self.test_cases),
+                self.stdout.text, self.stderr.text, self.wall_time)
+
+    @classmethod
+    def _unpack(cls, packed):
+        attrs, properties, test_cases, stdout, stderr, wall_time = packed
+        e = cls()
+        e._unpack_attrs(attrs)
+        e.wall_time = wall_time
+        e.properties.extend(Property._unpack(x) for x in properties)
+        e.test_cases.extend(TestCase._unpack(x) for x in test_cases)
+        e.stdout = StdOut._unpack(((), stdout))
+        e.stderr = StdErr._unpack(((), stderr))
+        # the packed counts may have been stale
+        e._invalidate()
+        return e
+
+    @classmethod
+    def _check_packed(cls, packed):
+        attrs, properties, test_cases, stdout, stderr, wall_time = \
+            _packed_items(packed, 6)
+        cls._check_packed_attrs(attrs)
+        for item in _packed_items(properties):
+            Property._check_packed(item)
+        for item in _packed_items(test_cases):
+            TestCase._check_packed(item)
+        _check_packed_value(stdout, str)
+        _check_packed_value(stderr, str)
+        _check_packed_value(wall_time, int, float, type(None))
 
     def get_digest(self):
-        self.eval_counts()
-        passed = (self.get('tests') - self.get('failures') - self.get('skipped')
-                  - self.get('disabled'))
+        passed = self.get_passed()
         return ("{:20} | total= {:5} | (P/F/S)=({:3}/{:3}/{:3})"
                 .format(self.get('name'),
                self.get('tests'), passed, self.get('failures'),
                self.get('skipped')))
 
     def get_digest_grep(self):
-        self.eval_counts()
-        passed = (self.get('tests') - self.get('failures') - self.get('skipped')
-                  - self.get('disabled'))
+        passed = self.get_passed()
         values = [str(x) for x in [self.get('name'), self.get('tests'), passed,
                                    self.get('failures'), self.get('skipped')]]
         return " ".join(values)
@@ -545,6 +1007,8 @@ class TestSuites(Element):
     file. It it's only children are TestSuites.
     """
 
+    __slots__ = ('_test_suites', '_children', '_dirty', '_passed', '_skipped')
+
     TAG = 'testsuites'
     ATTRS = {\
         'disabled': Spec(int, False, 0),
@@ -554,50 +1018,96 @@ class TestSuites(Element):
         'tests'   : Spec(int, False, 0),
         'time'    : Spec(int, False, 0),
         }
+    COUNTS = ('tests', 'errors', 'failures', 'time')
+    COUNTED_ATTRS = frozenset(COUNTS)
 
     def __init__(self, *args, **kwargs):
+        self._dirty = True
+        self._passed = 0
+        self._skipped = 0
         super().__init__(*args, **kwargs)
-        self.test_suites = []
+        self._test_suites = ElementList(self, adopt=True)
         self.eval_counts()
 
     def add_test_suite(self, test_suite):
         self.test_suites.append(test_suite)
-        self.eval_counts()
+
+    @property
+    def test_suites(self):
+        return self._test_suites
+
+    @test_suites.setter
+    def test_suites(self, value):
+        self._test_suites = ElementList(self, value, adopt=True)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._dirty = True
+
+    def _add_suite_counts(self, counts):
+        for attr in self.COUNTS:
+            self._set_count(attr, self.get(attr) + counts[attr])
+        self._passed += counts['passed']
+        self._skipped += counts['skipped']
+
+    def _children_added(self, suites):
+        if self._dirty:
+            return
+        for suite in suites:
+            counts = {'passed': suite.get_passed()}
+            counts.update((attr, suite.get(attr)) for attr in TestSuite.COUNTS)
+            self._add_suite_counts(counts)
+
+    def _suite_counts_changed(self, delta):
+        """Called by a child TestSuite when testcases are appended to it."""
+        if self._dirty:
+            return
+        delta = dict(delta)
+        delta['passed'] = delta['tests'] - delta['failures'] - delta['skipped']
+        self._add_suite_counts(delta)
+
+    def _pack(self):
+        return (self._pack_attrs(),
+                tuple(e._pack() for e in self.test_suites))
+
+    @classmethod
+    def _unpack(cls, packed):
+        e = cls()
+        e._unpack_attrs(packed[0])
+        e.test_suites.extend(TestSuite._unpack(x) for x in packed[1])
+        e._invalidate()
+        return e
+
+    @classmethod
+    def _check_packed(cls, packed):
+        attrs, test_suites = _packed_items(packed, 2)
+        cls._check_packed_attrs(attrs)
+        for item in _packed_items(test_suites):
+            TestSuite._check_packed(item)
 
     def eval_counts(self):
-        counts = ['tests', 'errors', 'failures', 'time']
-        for count in counts:
-            self.reset(count)
-        for suite in self.test_suites:
-            suite.eval_counts()
-            for count in counts:
-                self.set(count, self.get(count) + suite.get(count))
+        """Recomputes the aggregate counts from the testsuites, which are
+        kept current like those of TestSuite.
+        """
+        if not self._dirty:
+            return
+        for count in self.COUNTS:
+            self._set_count(count, 0)
+        self._passed = 0
+        self._skipped = 0
+        self._dirty = False
+        self._children_added(self._test_suites)
 
     def get_digest(self):
-        passed = 0
-        skipped = 0
-        for e_suite in self.test_suites:
-            e_suite.eval_counts()
-            passed += (e_suite.get('tests') - e_suite.get('failures') -
-                       e_suite.get('skipped') - e_suite.get('disabled'))
-            skipped += e_suite.get('skipped')
         self.eval_counts()
-
         return ("{:26} | {:^5} test suites | (P/F/S)=({}/{}/{})"
                .format(self.get('name'), len(self.test_suites),
-                       passed, self.get('failures'), skipped))
+                       self._passed, self.get('failures'), self._skipped))
 
     def get_digest_grep(self):
-        passed = 0
-        skipped = 0
-        for e_suite in self.test_suites:
-            e_suite.eval_counts()
-            passed += (e_suite.get('tests') - e_suite.get('failures') -
-                       e_suite.get('skipped') - e_suite.get('disabled'))
-            skipped += e_suite.get('skipped')
         self.eval_counts()
-        return " ".join([self.get('name'), len(self.test_suites), passed,
-                         self.get('failures'), skipped])
+        return " ".join([self.get('name'), len(self.test_suites), self._passed,
+                         self.get('failures'), self._skipped])
 
     def get_xml_element(self, verbose=False):
         self._children = []
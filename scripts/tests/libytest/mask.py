@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import fnmatch
 import re
 import shlex
 
@@ -12,6 +13,14 @@ class MaskEntry():
     #MaskEntry.type_
     #MaskEntry.regex
 
+    # Testcase IDs are only globs when they are marked with this prefix;
+    # unmarked IDs are matched literally, even if they contain '*?['.
+    GLOB_PREFIX = 'glob:'
+    GLOB_CHARS = '*?['
+    # Patterns containing backreferences, conditionals or global inline flags
+    # cannot be safely combined into a single alternation.
+    RE_UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)')
+
     TYPE_ALL = 'all'
     TYPES = [
         'error',
@@ -19,6 +28,9 @@ class MaskEntry():
     ]
 
     def __init__(self, testcase_id, type_, regex):
+        is_glob = testcase_id.startswith(self.GLOB_PREFIX)
+        if is_glob:
+            testcase_id = testcase_id[len(self.GLOB_PREFIX):]
         self._parse_testcase_id(testcase_id)
 
         if not type_ in MaskEntry.TYPES and type_ != self.TYPE_ALL:
@@ -28,6 +40,18 @@ class MaskEntry():
 
         self.regex = re.compile(regex, re.M)
 
+        # Glob testcase IDs match any testcase whose full
+        # '<testsuite>:<classname>.<name>' ID matches the glob.
+        if is_glob:
+            self.glob = testcase_id
+            self.glob_regex = re.compile(fnmatch.translate(testcase_id))
+        else:
+            self.glob = None
+            self.glob_regex = None
+
+    def applies_to(self, type_):
+        return self.type_ == self.TYPE_ALL or self.type_ == type_
+
     def apply_to_testcase(self, testcase):
         removals = []
 
@@ -50,7 +74,15 @@ class MaskEntry():
         match = self.regex.match(element.get('message'))
         return True if match else False
 
+    @property
+    def combinable(self):
+        return not self.RE_UNCOMBINABLE.search(self.regex.pattern)
+
     def is_testcase(self, testsuite, testcase):
+        if self.glob_regex is not None:
+            return bool(self.glob_regex.match(
+                testcase_id(testsuite.get('name'), testcase.get('classname'),
+                            testcase.get('name'))))
         if testsuite.get('name') != self.testsuite_name:
             return False
         if testcase.get('classname') != self.testcase_classname:
@@ -59,6 +91,11 @@ class MaskEntry():
             return False
         return True
 
+    @property
+    def key(self):
+        return (self.testsuite_name, self.testcase_classname,
+                self.testcase_name)
+
     def _parse_testcase_id(self, testcase_id):
         self.testsuite_name, _, testcase_names = testcase_id.partition(':')
         self.testcase_classname, _, self.testcase_name = testcase_names.rpartition('.')
@@ -74,17 +111,76 @@ class MaskEntry():
         return ret
 
 
+class MaskIndex():
+    """A lookup structure for the entries of a Mask. Plain entries are hashed
+    by their (testsuite, classname, name) key. Glob entries are stored in a
+    character trie, under the literal prefix of their glob, so that only the
+    globs whose prefix matches a testcase ID need to be tried against it.
+    """
+
+    def __init__(self, entries):
+        self.exact = {}
+        self.trie = {}
+        self.n_globs = 0
+        # entries are identified by their position in the mask, so that the
+        # entries which apply to a testcase can be ordered as in the mask file
+        for order, entry in enumerate(entries):
+            if entry.glob is None:
+                self.exact.setdefault(entry.key, []).append((order, entry))
+                continue
+            node = self.trie
+            for c in self._glob_prefix(entry.glob):
+                node = node.setdefault(c, {})
+            node.setdefault(None, []).append((order, entry))
+            self.n_globs += 1
+
+    @staticmethod
+    def _glob_prefix(glob):
+        for i, c in enumerate(glob):
+            if c in MaskEntry.GLOB_CHARS:
+                return glob[:i]
+        return glob
+
+    def lookup(self, testsuite_name, classname, name):
+        """Returns the list of (order, MaskEntry) tuples which apply to the
+        testcase, in mask file order.
+        """
+        matches = list(self.exact.get((testsuite_name, classname, name), ()))
+        if self.n_globs > 0:
+            tc_id = testcase_id(testsuite_name, classname, name)
+            node = self.trie
+            for c in tc_id + '\0':
+                for order, entry in node.get(None, ()):
+                    if entry.glob_regex.match(tc_id):
+                        matches.append((order, entry))
+                node = node.get(c)
+                if node is None:
+                    break
+            matches.sort(key=lambda match: match[0])
+        return matches
+
+
 class Mask():
     """
     Mask file format:
     <testsuite name>:<testcase classname>.<testcase name> <type> <regex>
     # <- comment character
+
+    A testcase ID prefixed with 'glob:' is a glob (eg.
+    'glob:glibc:glibc.ptest.*'), matched against the full
+    '<testsuite name>:<testcase classname>.<testcase name>' ID. Other IDs are
+    matched literally, so that IDs like 'salt:mod.test_y[param]' match
+    themselves.
     """
 
     def __init__(self, file_path = None):
         self.mask_entries = []
+        # combined message regexes, keyed by the orders of their entries
+        self._combined = {}
+        self._index = None
+        self._index_key = None
         if file_path is not None:
-            self.load_mask_file(self.file_path)
+            self.load_mask_file(file_path)
 
     def load_mask_file(self, file_path):
         self.file_path = file_path
@@ -107,6 +203,80 @@ class Mask():
                 expects.append(entry)
 
         self.mask_entries = expects
+        self._combined = {}
+        self._index = None
+
+    def _combined_regex(self, matches):
+        """Returns a single regex which matches a message if any of the
+        entries in `matches` does. The name of the outermost group of a match
+        identifies the first matching entry. Returns None if the entry
+        regexes cannot be combined.
+        """
+        key = tuple(order for order, _ in matches)
+        try:
+            return self._combined[key]
+        except KeyError:
+            pass
+        regex = None
+        if all(entry.combinable for _, entry in matches):
+            try:
+                regex = re.compile('|'.join(
+                    '(?P<_m%d>%s)' % (order, entry.regex.pattern)
+                    for order, entry in matches), re.M)
+            except re.error:
+                regex = None
+        self._combined[key] = regex
+        return regex
+
+    def _first_match(self, matches, regex, message):
+        """Returns the order of the first entry in `matches` which matches
+        `message`, or None.
+        """
+        if regex is not None:
+            match = regex.match(message)
+            if match is None:
+                return None
+            if match.lastgroup is not None and match.lastgroup.startswith('_m'):
+                return int(match.lastgroup[2:])
+        for order, entry in matches:
+            if entry.regex.match(message):
+                return order
+        return None
+
+    def _apply_entries(self, matches, testcase):
+        """Applies the entries of `matches` to `testcase`, with the same
+        result as applying each of them in turn with
+        MaskEntry.apply_to_testcase().
+        """
+        removed = []  # (entry order, group, element index, element)
+        for group, type_ in ((0, 'error'), (1, 'failure')):
+            elements = testcase.errors if group == 0 else testcase.failures
+            typed = [m for m in matches if m[1].applies_to(type_)]
+            if len(elements) == 0 or len(typed) == 0:
+                continue
+            regex = self._combined_regex(typed)
+            kept = []
+            for i, element in enumerate(elements):
+                order = self._first_match(typed, regex, element.get('message'))
+                if order is None:
+                    kept.append(element)
+                else:
+                    removed.append((order, group, i, element))
+            if len(kept) != len(elements):
+                elements[:] = kept
+
+        testcase.eval_status()
+        removed.sort(key=lambda r: r[:3])
+        return [r[3] for r in removed]
+
+    def _get_index(self):
+        # mask_entries may be replaced or extended by the user of the Mask
+        key = (id(self.mask_entries), len(self.mask_entries))
+        if self._index is None or self._index_key != key:
+            self._index = MaskIndex(self.mask_entries)
+            self._index_key = key
+            self._combined = {}
+        return self._index
 
     def mask_expectations(self, testsuites):
         removals = []
@@ -114,14 +284,42 @@ class Mask():
             return removals
 
         for testsuite in testsuites.test_suites:
-            for testcase in testsuite.test_cases:
-                for entry in self.mask_entries:
-                    if entry.is_testcase(testsuite, testcase):
-                        removals.extend(entry.apply_to_testcase(testcase))
+            removals.extend(self.mask_testsuite(testsuite))
+        return removals
+
+    def mask_testsuite(self, testsuite):
+        """Applies the mask to a single TestSuite. Masking a testsuite more
+        than once has no further effect.
+        """
+        removals = []
+        if len(self.mask_entries) == 0:
+            return removals
+
+        suite_name = testsuite.get('name')
+        for testcase in testsuite.test_cases:
+            removals.extend(self.mask_testcase(suite_name, testcase))
         return removals
 
+    def mask_testcase(self, testsuite_name, testcase):
+        """Applies the mask to a single testcase of the suite
+        `testsuite_name`. `testcase` may be anything with the `get()`,
+        `errors`, `failures` and `eval_status()` of a TestCase.
+        """
+        if len(self.mask_entries) == 0:
+            return []
+
+        matches = self._get_index().lookup(testsuite_name,
+            testcase.get('classname'), testcase.get('name'))
+        if not matches:
+            return []
+        return self._apply_entries(matches, testcase)
+
     def __str__(self):
         ret = ""
         for entry in self.mask_entries:
             ret += 'M> ' + str(entry) + '\n'
         return ret
+
+
+def testcase_id(testsuite_name, classname, name):
+    return '%s:%s.%s' % (testsuite_name, classname, name)
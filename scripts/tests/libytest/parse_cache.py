@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# vi: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# An on-disk cache of parsed console TestSuites. Entries are keyed by the
+# content hash of the console and by the parser version, so that re-masking
+# or re-serializing a console which has already been parsed skips the parse
+# entirely. Entries are stored in the packed form, as validated JSON (see
+# libytest.dump_testsuites_json) rather than as pickles, since the cache
+# directory may be shared; they are zlib-compressed, and the least-recently
+# used entries are evicted once the cache grows beyond its size limit.
+# Entries which are not owned by the current user are never loaded.
+
+import hashlib
+import os
+import tempfile
+import zlib
+
+from .parsers import PARSER_VERSION
+from . import libytest as YT
+
+MAGIC = b'YTPC2\n'
+SUFFIX = '.ytpc'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ParseCache():
+    """A directory of cached parse results, no larger than `max_bytes`."""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_digest, *options):
+        """Returns the cache key of a console whose content hashes to
+        `content_digest`, parsed by the current parsers with `options`.
+        """
+        h = hashlib.sha256()
+        h.update(('%s\0%d' % (content_digest, PARSER_VERSION)).encode())
+        for option in options:
+            h.update(('\0%r' % (option,)).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + SUFFIX)
+
+    def load(self, key):
+        """Returns the cached TestSuites for `key`, or None. Unreadable
+        entries are discarded.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                if not self._is_own(os.fstat(fp.fileno())):
+                    return None
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            if not data.startswith(MAGIC):
+                raise ValueError('bad cache entry header')
+            e_suites = YT.load_testsuites_json(
+                zlib.decompress(data[len(MAGIC):]))
+        except Exception:
+            self._remove(path)
+            return None
+
+        # refresh the entry's position in the eviction order
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return e_suites
+
+    def store(self, key, e_suites):
+        """Stores `e_suites` under `key`, then evicts entries as needed."""
+        data = MAGIC + zlib.compress(YT.dump_testsuites_json(e_suites))
+        if len(data) > self.max_bytes:
+            return
+
+        # write to a temporary file and rename it into place, so that
+        # concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Removes the least-recently used entries until the cache is no
+        larger than `max_bytes`.
+        """
+        entries = []
+        total = 0
+        for dirent in os.scandir(self.cache_dir):
+            if not dirent.name.endswith(SUFFIX):
+                continue
+            try:
+                stat = dirent.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, dirent.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for dirent in os.scandir(self.cache_dir):
+            if dirent.name.endswith(SUFFIX):
+                self._remove(dirent.path)
+
+    @staticmethod
+    def _is_own(stat):
+        if not hasattr(os, 'getuid'):  # no file ownership to check
+            return True
+        return stat.st_uid == os.getuid()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
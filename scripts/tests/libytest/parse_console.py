@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import Future, ProcessPoolExecutor
 import io
 import os
 import re
 import sys
+import time
 
-from .parsers import PTestRunnerParser, ConsoleParser
+from .parsers import PTestRunnerParser, PTestRunnerTokenizer, ConsoleParser
+from .console_source import ConsoleSource, ENCODING, ENCODING_ERRORS
+from .history import HistoryStore
 from .mask import Mask
+from .parse_cache import ParseCache
+from . import profiling
+from . import summary as YS
 from . import libytest as YT
 
+FOLLOW_CHUNK_SIZE = 1024 * 1024
+FOLLOW_POLL_INTERVAL = 0.5  # seconds
+
 class Application():
     """CLI Application class
     """
@@ -17,20 +27,63 @@ class Application():
     def __init__(self, args):
         self.config = args
         self.mask = None
+        self.cache = None
+        cache_dir = getattr(args, 'cache_dir', None)
+        if cache_dir:
+            cache_size = getattr(args, 'cache_size', None)
+            if cache_size is not None:
+                self.cache = ParseCache(cache_dir, cache_size * 1024 * 1024)
+            else:
+                self.cache = ParseCache(cache_dir)
 
     def main(self):
+        """Runs the application, under the profilers requested by the
+        `profile` and `profile_cprofile` configs.
+        """
+        profile = getattr(self.config, 'profile', None)
+        cprofile = getattr(self.config, 'profile_cprofile', None)
+        if not profile and not cprofile:
+            return self.run()
+
+        if profile:
+            profiler = profiling.enable()
+        if cprofile:
+            import cProfile
+            c_profiler = cProfile.Profile()
+            c_profiler.enable()
+        try:
+            return self.run()
+        finally:
+            if cprofile:
+                c_profiler.disable()
+                c_profiler.dump_stats(cprofile)
+            if profile:
+                profiling.disable()
+                profiler.write_json(profile)
+                if self.config.verbose:
+                    print("Wrote the profile to: {}".format(profile))
+
+    def run(self):
         if self.config.mask_file:
             self.load_mask_file()
 
-        suites = []
-        for console in self.config.console_file:
-            suites.append(self.parse_console_file(console))
-        e_suites = self.merge_suites(*suites)
+        if getattr(self.config, 'summary', None):
+            return self.main_summary()
 
+        if getattr(self.config, 'follow', False):
+            return self.main_follow()
+
+        suites = self.parse_console_files(self.config.console_file)
+        return self.report(self.merge_suites(*suites))
+
+    def report(self, e_suites):
+        """Masks, prints and writes out the parsed `e_suites`."""
         rc = 0
 
         if self.mask:
-            removals = self.mask.mask_expectations(e_suites)
+            with profiling.phase('mask') as stats:
+                removals = self.mask.mask_expectations(e_suites)
+                stats.add(removals=len(removals))
             if self.config.verbose:
                 self._print_mask_removals(removals)
 
@@ -39,10 +92,154 @@ class Application():
         elif self.config.verbose:
             self.print_testsuites_digest(e_suites)
 
+        if getattr(self.config, 'history', None):
+            with profiling.phase('history'):
+                self.record_history(e_suites)
+
         self.write_xml(e_suites)
 
         return rc
 
+    def main_summary(self):
+        """Parses the consoles into per-suite counts only, and prints them as
+        a digest (grepable, if that is configured) or as JSON lines. Neither
+        a TestSuites tree nor an output file is made.
+        """
+        summaries = []
+        removals = []
+        for filepath in self.config.console_file:
+            if self.config.verbose:
+                print("Parsing {}...".format(filepath))
+            with profiling.phase('summarize'), \
+                 ConsoleSource(filepath) as source:
+                console_summary = YS.summarize_console(source.view(),
+                    getattr(self.config, 'ptest_only', False), self.mask,
+                    filepath)
+                summaries.extend(console_summary.result())
+            removals.extend(console_summary.removals)
+
+        if self.mask and self.config.verbose:
+            self._print_mask_removals(removals)
+
+        if self.config.summary == 'json':
+            for summary in summaries:
+                print(summary.to_json())
+        elif getattr(self.config, 'grepable', False):
+            for summary in summaries:
+                print(summary.get_digest_grep())
+        else:
+            print("[ {} ]".format(YS.get_digest(summaries)))
+            for summary in summaries:
+                print("  |-> [ {} ]".format(summary.get_digest()))
+        return 0
+
+    def main_follow(self):
+        """Follows a single, growing console file. ptest suites are parsed,
+        masked and reported as soon as they end, and the output file is
+        rewritten with the suites found so far every `interval` seconds. The
+        complete results are written once the console stops growing for
+        `idle_timeout` seconds, or on an interrupt.
+        """
+        if len(self.config.console_file) != 1:
+            raise ValueError("--follow takes exactly one console file.")
+        filepath = self.config.console_file[0]
+        self._removals = []
+        self._reported = set()
+
+        e_suites = self.follow_console(filepath)
+
+        if self.mask:
+            self._removals.extend(self.mask.mask_expectations(e_suites))
+            if self.config.verbose:
+                self._print_mask_removals(self._removals)
+
+        remaining = [e_suite for e_suite in e_suites.test_suites
+                     if id(e_suite) not in self._reported]
+        if getattr(self.config, 'grepable', False):
+            for e_suite in remaining:
+                print(e_suite.get_digest_grep())
+        elif self.config.verbose:
+            for e_suite in remaining:
+                print("  |-> [ {} ]".format(e_suite.get_digest()))
+            print("[ {} ]".format(e_suites.get_digest()))
+
+        if getattr(self.config, 'history', None):
+            self.record_history(e_suites)
+
+        self.write_xml(e_suites)
+        return 0
+
+    def follow_console(self, filepath):
+        interval = getattr(self.config, 'interval', 30)
+        idle_timeout = getattr(self.config, 'idle_timeout', 300)
+        live = LiveConsoleParser(getattr(self.config, 'ptest_only', False),
+            on_suite=lambda e_suite: self._on_live_suite(e_suite, filepath))
+
+        if self.config.verbose:
+            print("Following {}...".format(filepath))
+        t_data = time.monotonic()
+        while not os.path.exists(filepath):
+            if idle_timeout and time.monotonic() - t_data >= idle_timeout:
+                raise FileNotFoundError(filepath)
+            time.sleep(FOLLOW_POLL_INTERVAL)
+
+        with open(filepath, 'rb') as fp:
+            t_data = t_write = time.monotonic()
+            n_written = 0
+            try:
+                while True:
+                    data = fp.read(FOLLOW_CHUNK_SIZE)
+                    now = time.monotonic()
+                    if data:
+                        live.feed(data)
+                        t_data = now
+                    elif os.fstat(fp.fileno()).st_size < live.n_bytes:
+                        raise RuntimeError("{} was truncated while being "
+                                           "followed.".format(filepath))
+                    elif idle_timeout and now - t_data >= idle_timeout:
+                        break
+
+                    if now - t_write >= interval \
+                       and len(live.completed) != n_written:
+                        self.write_xml(live.snapshot(), partial=True)
+                        n_written = len(live.completed)
+                        t_write = now
+                    if not data:
+                        time.sleep(FOLLOW_POLL_INTERVAL)
+            except KeyboardInterrupt:
+                pass
+
+        e_suites = live.close()
+        # the ptest suites were named as they were parsed
+        named = set(id(e_suite) for e_suite in live.completed)
+        for e_suite in e_suites.test_suites:
+            if id(e_suite) not in named:
+                e_suite.properties.append(
+                    YT.Property('console-name', filepath))
+        return e_suites
+
+    def _on_live_suite(self, e_suite, console_name):
+        e_suite.properties.append(YT.Property('console-name', console_name))
+        if self.mask:
+            self._removals.extend(self.mask.mask_testsuite(e_suite))
+
+        if getattr(self.config, 'grepable', False):
+            print(e_suite.get_digest_grep(), flush=True)
+        elif self.config.verbose:
+            print("  |-> [ {} ]".format(e_suite.get_digest()), flush=True)
+        self._reported.add(id(e_suite))
+
+    def record_history(self, e_suites):
+        """Appends the (masked) results in `e_suites` to the history
+        database.
+        """
+        console_files = getattr(self.config, 'console_file', None) or []
+        with HistoryStore(self.config.history) as history:
+            run_id = history.record(e_suites, console=' '.join(console_files),
+                variant=getattr(self.config, 'history_variant', None))
+        if self.config.verbose:
+            print("Recorded run {} in: {}".format(run_id, self.config.history))
+
     def eval_masks(self, results):
         rc = 0
         for suite, items in results.items():
@@ -56,7 +253,9 @@ class Application():
         if self.config.verbose:
             print("Loading mask file: {}".format(self.config.mask_file))
         self.mask.load_mask_file(self.config.mask_file)
-        print(self.mask)
+        # keep JSON lines output parseable
+        if getattr(self.config, 'summary', None) != 'json':
+            print(self.mask)
 
     def merge_suites(self, *suites):
         e_ret = YT.TestSuites()
@@ -71,45 +270,11 @@ class Application():
         return e_ret
 
     def parse_console(self, console, console_name=None):
-        parser_console = ConsoleParser()
-        parser_ptest_runner = PTestRunnerParser()
-        suites = []  # TestSuites accumulator (for later merging)
-
-        # find the ptest runner segments of the console log (if any)
-        ptest_segments = parser_ptest_runner.find_runner_segments(console)
-
-        # Parse Ptest Runner segments (if present)
-        for seg in ptest_segments:
-            subconsole = io.StringIO()
-
-            console.seek(seg[0])
-            subconsole.write(console.read(seg[1] - seg[0]))
-            suites.append(parser_ptest_runner.parse(subconsole))
-
-        if not getattr(self.config, 'ptest_only', False):
-            # Parse the remainder of the console
-            console_suites = []
-            for i in range(0, len(ptest_segments) + 1):
-                if i == 0:
-                    start = 0
-                else:
-                    start = ptest_segments[i-1][1]
-                try:
-                    end = ptest_segments[i][0]
-                except IndexError:
-                    end = None
-                subconsole = io.StringIO()
-                console.seek(start)
-
-                if end is not None:
-                    subconsole.write(console.read(end - start))
-                else:
-                    subconsole.write(console.read())
-
-                console_suites.extend(parser_console.parse(subconsole).test_suites)
-            suites.append(parser_console.merge_console_testsuites(*console_suites))
-
-        e_suites = self.merge_suites(*suites)
+        e_suites = self._parse_console(console)
+        self.add_console_name(e_suites, console_name)
+        return e_suites
+
+    def add_console_name(self, e_suites, console_name):
         # if console_name is asserted, add a property to each testsuite that
         # expresses that name
         if console_name:
@@ -117,21 +282,79 @@ class Application():
                 e_prop_name = YT.Property('console-name', console_name)
                 e_suite.properties.append(e_prop_name)
 
-        return e_suites
+    def _parse_console(self, console):
+        # Walk the console once; ptest-runner segments are parsed suite by
+        # suite as they are tokenized, and the remainder of the console is
+        # handed to the general console parser. If `suite_jobs` is asserted,
+        # the suites are parsed by a pool of worker processes while the
+        # tokenizer carries on.
+        suite_jobs = getattr(self.config, 'suite_jobs', 1) or 1
+        executor = None
+        if suite_jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=suite_jobs)
+
+        results = ConsoleResults(getattr(self.config, 'ptest_only', False),
+                                 executor)
+        console.seek(0)
+        try:
+            # the self time of this phase is that of the tokenizer
+            with profiling.phase('tokenize') as stats:
+                for event, payload in \
+                        results.parser_runner.iter_events(console):
+                    results.handle_event(event, payload)
+                e_suites = results.result()
+                if profiling.active() is not None:
+                    stats.add(**element_counts(e_suites))
+            return e_suites
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
     def parse_console_file(self, filepath):
         if self.config.verbose:
             print("Parsing {}...".format(filepath))
 
-        console = io.StringIO()
-        with open(filepath, 'r', encoding='utf-8', errors='replace',
-                  newline='') as fp_console:
-            console.write(fp_console.read())
-
-        #self.sanitize_console(console)
-        e_suites = self.parse_console(console, filepath)
+        with profiling.phase('read') as stats:
+            source = ConsoleSource(filepath)
+            if profiling.active() is not None:
+                stats.add(bytes=len(source),
+                          lines=source.view().count_lines())
+        with source:
+            #self.sanitize_console(console)
+            if self.cache is None:
+                return self.parse_console(source.view(), filepath)
+
+            # the console name is not part of the cached result, so that
+            # copies of a console at different paths share an entry
+            with profiling.phase('cache_load') as stats:
+                key = ParseCache.make_key(source.digest(),
+                    getattr(self.config, 'ptest_only', False))
+                e_suites = self.cache.load(key)
+                stats.add(hits=e_suites is not None)
+            if e_suites is not None:
+                if self.config.verbose:
+                    print("Using cached parse of {}".format(filepath))
+            else:
+                e_suites = self._parse_console(source.view())
+                with profiling.phase('cache_store'):
+                    self.cache.store(key, e_suites)
+        self.add_console_name(e_suites, filepath)
         return e_suites
 
+    def parse_console_files(self, filepaths):
+        """Parses each of the console files in `filepaths` and returns their
+        TestSuites, in the same order. If the `jobs` config is greater than
+        1, the files are parsed concurrently in a pool of worker processes.
+        """
+        jobs = min(getattr(self.config, 'jobs', 1) or 1, len(filepaths))
+        if jobs <= 1:
+            return [self.parse_console_file(fp) for fp in filepaths]
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            packed = executor.map(_parse_console_file_packed,
+                                  [self.config] * len(filepaths), filepaths)
+            return [YT.unpack_testsuites(data) for data in packed]
+
     def _print_mask_removals(self, removals):
         print("Masked-out %d entries." % len(removals))
 
@@ -165,29 +388,222 @@ class Application():
 #            RE_ANSI_CONTROL.sub('', line)
 #            RE_CARRIAGE_RETURN.sub('', line)
 
-    def write_xml(self, root):
-        if self.config.verbose:
-            print("Writing results to: {}...".format(self.config.output_file))
-        fp_out = open(self.config.output_file, 'wb')
-        YT.write_xml(root, fp_out, verbose=self.config.verbose_output)
-        fp_out.close()
+    def write_xml(self, root, partial=False):
+        """Writes `root` to the output file. A partial result is written to a
+        temporary file which then replaces the output file, so that readers
+        never see an incomplete document.
+        """
+        filepath = self.config.output_file
+        if partial:
+            filepath += '.partial'
+        elif self.config.verbose:
+            print("Writing results to: {}...".format(filepath))
+        with profiling.phase('write_xml') as stats:
+            fp_out = open(filepath, 'wb')
+            YT.write_xml_stream(root, fp_out,
+                                verbose=self.config.verbose_output)
+            stats.add(bytes=fp_out.tell())
+            fp_out.close()
+        if partial:
+            os.replace(filepath, self.config.output_file)
+
+def element_counts(e_suites):
+    """Returns a dict of the numbers of suites, testcases, failures and errors
+    in the TestSuites `e_suites`.
+    """
+    counts = {'suites': 0, 'testcases': 0, 'failures': 0, 'errors': 0}
+    for e_suite in e_suites.test_suites:
+        counts['suites'] += 1
+        counts['testcases'] += len(e_suite.test_cases)
+        for e_case in e_suite.test_cases:
+            counts['failures'] += len(e_case.failures)
+            counts['errors'] += len(e_case.errors)
+    return counts
+
+def _parse_console_file_packed(config, filepath):
+    """Process pool entry point. Returns the parsed TestSuites in their
+    packed form, which is much cheaper to send between processes than the
+    element tree itself.
+    """
+    return YT.pack_testsuites(Application(config).parse_console_file(filepath))
+
+
+class ConsoleResults():
+    """Builds the TestSuites of a console from the `(event, payload)` tuples
+    of a PTestRunnerTokenizer. ptest suites are parsed as soon as their
+    blocks are complete; by `executor`, if one is given.
+    """
+
+    def __init__(self, ptest_only=False, executor=None, on_suite=None):
+        self.parser_console = ConsoleParser()
+        self.parser_runner = PTestRunnerParser()
+        self.ptest_only = ptest_only
+        self.executor = executor
+        # called with each ptest TestSuite which is parsed in-process
+        self.on_suite = on_suite
+        self.completed = []  # ptest TestSuites (or Futures), in console order
+        # wall time of each ptest suite, from the runner timestamps around it
+        self.suite_durations = {}
+        self._runners = []  # TestSuites of each ptest-runner segment
+        self._runner_suites = None
+        self._console_suites = []
+
+    def handle_event(self, event, payload):
+        if event == PTestRunnerTokenizer.EV_SUITE:
+            if payload.ts_start is not None and payload.ts_end is not None:
+                self.suite_durations[payload.name] = \
+                    payload.ts_end - payload.ts_start
+            suite_id = len(self._runner_suites)
+            if self.executor is not None:
+                e_suite = self.parser_runner.submit_suite_block(
+                    self.executor, payload, suite_id)
+            else:
+                e_suite = self.parser_runner.parse_suite_block(
+                    payload, suite_id)
+                if self.on_suite is not None:
+                    self.on_suite(e_suite)
+            self._runner_suites.append(e_suite)
+            self.completed.append(e_suite)
+        elif event == PTestRunnerTokenizer.EV_RUNNER_START:
+            self._runner_suites = []
+        elif event == PTestRunnerTokenizer.EV_RUNNER_END:
+            e_runner = YT.TestSuites()
+            for e_suite in self._runner_suites:
+                if isinstance(e_suite, Future):
+                    e_suite = YT.unpack_testsuite(e_suite.result())
+                e_runner.test_suites.append(e_suite)
+            e_runner.set('name', 'ptests')
+            self._runners.append(e_runner)
+            self._runner_suites = None
+        elif event == PTestRunnerTokenizer.EV_CONSOLE and not self.ptest_only:
+            with profiling.phase('console_parser') as stats:
+                self._console_suites.extend(
+                    self.parser_console.parse(payload).test_suites)
+                if profiling.active() is not None:
+                    stats.add(lines=profiling.count_lines(payload))
+
+    def handle_events(self, events):
+        for event, payload in events:
+            self.handle_event(event, payload)
+
+    def result(self):
+        """Returns the TestSuites of every closed runner segment, followed by
+        the merged general console suite.
+        """
+        e_ret = YT.TestSuites()
+        for e_runner in self._runners:
+            e_ret.test_suites.extend(e_runner.test_suites)
+        if not self.ptest_only:
+            e_ret.test_suites.append(self.parser_console
+                .merge_console_testsuites(*self._console_suites))
+        return e_ret
+
+    def snapshot(self):
+        """Returns a TestSuites of the ptest suites which have been parsed so
+        far. The general console suite is only available from `result()`.
+        """
+        e_ret = YT.TestSuites()
+        e_ret.test_suites.extend(e_suite for e_suite in self.completed
+                                 if not isinstance(e_suite, Future))
+        return e_ret
+
+
+class LiveConsoleParser(ConsoleResults):
+    """Parses a console incrementally, from chunks of bytes which are fed as
+    they are produced. Each byte is tokenized exactly once; a trailing
+    partial line is held back until the rest of it arrives.
+    """
+
+    def __init__(self, ptest_only=False, on_suite=None):
+        super().__init__(ptest_only, on_suite=on_suite)
+        self.tokenizer = PTestRunnerTokenizer(type(self.parser_runner))
+        self.n_bytes = 0
+        self._pending = []  # chunks of the current, incomplete line
+
+    def feed(self, data):
+        if not data:
+            return
+        self.n_bytes += len(data)
+        if b'\n' not in data:
+            self._pending.append(data)
+            return
+        if self._pending:
+            self._pending.append(data)
+            data = b''.join(self._pending)
+            self._pending = []
+
+        pos = 0
+        while True:
+            eol = data.find(b'\n', pos)
+            if eol < 0:
+                break
+            self._feed_line(data[pos:eol + 1])
+            pos = eol + 1
+        if pos < len(data):
+            self._pending.append(data[pos:])
+
+    def _feed_line(self, line):
+        self.handle_events(self.tokenizer.feed(
+            line.decode(ENCODING, ENCODING_ERRORS)))
+
+    def close(self):
+        """Flushes any partial line and incomplete runner segment, and returns
+        the console's TestSuites.
+        """
+        if self._pending:
+            self._feed_line(b''.join(self._pending))
+            self._pending = []
+        self.handle_events(self.tokenizer.close())
+        return self.result()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-dir', action='store',
+                        help='Cache parsed consoles in this directory, keyed by their content.')
+    parser.add_argument('--cache-size', action='store', type=int,
+                        help='Maximum size of the parse cache, in MiB (default: 256).')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='Follow a growing console file, reporting ptest suites as they end.')
     parser.add_argument('-g', '--grepable', action='store_true',
                         help='Output runtime information in a more grep-friendly fashion')
+    parser.add_argument('--history', action='store',
+                        help='Append the suite and testcase results to this SQLite history database.')
+    parser.add_argument('--history-variant', action='store', default='',
+                        help='Record the results under this variant (eg. the VM size) in the history.')
+    parser.add_argument('--idle-timeout', action='store', type=float, default=300,
+                        help='With --follow, stop once the console has not grown for this many seconds (0: never).')
+    parser.add_argument('--interval', action='store', type=float, default=30,
+                        help='With --follow, rewrite the output file at most this often, in seconds.')
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                        help='Parse up to this many console files in parallel.')
     parser.add_argument('-m', '--mask-file', action='store',
                         help="Mask file")
     parser.add_argument('-p', '--ptest-only', action='store_true',
                         help='Only process the ptest-runner section, if one is available.')
+    parser.add_argument('--profile', action='store',
+                        help='Write the time, line and element counts and peak RSS of each parsing phase to this JSON file. Work done by -j/--suite-jobs worker processes is not broken down.')
+    parser.add_argument('--profile-cprofile', action='store',
+                        help='Write cProfile statistics of the run to this file.')
+    parser.add_argument('-s', '--summary', action='store', choices=['digest', 'json'],
+                        help='Only count the testcases of each suite, and print the counts as a digest or as JSON lines, without writing an output file.')
+    parser.add_argument('--suite-jobs', action='store', type=int, default=1,
+                        help='Parse the ptest suites of each console in up to this many worker processes.')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help="Enable more verbose output.")
     parser.add_argument('--verbose-output', action='store_true',
                         help='Print xml tags which are not required by junit, even if empty.')
     parser.add_argument('console_file', nargs='+',
                         help="ptest-runner2 console to parse.")
-    parser.add_argument('output_file', action='store', help="Output file")
+    parser.add_argument('output_file', nargs='?', action='store',
+                        help="Output file (not with --summary)")
     args = parser.parse_args()
+    # console_file takes every positional argument; the last one is the
+    # output file, unless only a summary is printed
+    if not args.summary:
+        if len(args.console_file) < 2:
+            parser.error('the following arguments are required: output_file')
+        args.output_file = args.console_file.pop()
 
     app = Application(args)
     sys.exit(app.main())
@@ -1,2 +1,6 @@
-from .ptest_runner_parser import PTestRunnerParser
+# Bump PARSER_VERSION whenever a change to the parsers changes the TestSuites
+# they produce from the same console; it invalidates cached parse results.
+PARSER_VERSION = 2
+
+from .ptest_runner_parser import PTestRunnerParser, PTestRunnerTokenizer
 from .console_parser import ConsoleParser
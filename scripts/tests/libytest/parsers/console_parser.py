@@ -58,8 +58,8 @@ class ConsoleParser():
             # children
             tcases.extend(testsuite.test_cases)
             e_return.properties.extend(testsuite.properties)
-            e_return.stdout.text += testsuite.stdout.text
-            e_return.stderr.text += testsuite.stderr.text
+            e_return.stdout += testsuite.stdout
+            e_return.stderr += testsuite.stderr
             # attributes
             testsuite.eval_counts()
             e_return.set('time', e_return.get('time') + testsuite.get('time'))
@@ -89,6 +89,18 @@ class ConsoleParser():
 
         return e_suites
 
+    def summarize(self, console, add_testcase):
+        """Like `parse()`, but reports the general testcase through
+        add_testcase(classname, name, skipped, elements).
+        """
+        console.seek(0)
+        add_testcase(self.suite_name, 'general', False, parse_errors(console, [
+            'python',
+            'shell',
+            'boot',
+            'generic',
+        ]))
+
     def _parse_runner(self, console, name='ptests'):
         e_suites = YT.TestSuites()
         suite_id = 0
@@ -1,63 +1,115 @@
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+from functools import lru_cache
 from io import StringIO
 import re
 
 from .. import libytest as YT
+from .. import profiling
+from .prefilter import KeywordFilter
 
 
-def parse_errors(text, error_types):
+def parse_errors(text, error_types, prefilter=True):
     """ Parses the provided StringIO text through the parsers
     specified by 'error_types'. The entire stdout buffer will be
     parsed, and then reset to its original position.
 
     For a list of valid `error_type` strings, check this module's
     ERROR_TYPES.keys(). The `error_type` parameter is order-sensitive. Handlers
-    are processed in FIFO order.
+    are processed in FIFO order; a line which is consumed by one handler is not
+    seen by the handlers which follow it.
 
-    Hereafter "stderr" refers to a stringIO buffer of important error text,
-    parsed from the `text` input.
+    All of the handlers are run together, in a single pass over the text. Unless
+    `prefilter` is False, lines which contain none of the handlers' KEYWORDS
+    are rejected by a KeywordFilter, before any handler regex sees them.
 
-    Returns: tuple of:
-        ( list of error elements, list of failure elements,
-         io.Stringio stderr)
+    Returns: list of error and failure elements, grouped by handler in
+        `error_types` order.
     """
-    # fill the `handlers` list with class pointers of the Handler class,
-    # specified by name in the error_types collection.
-    handlers = []
-    for _type in error_types:
-        handlers.append(ERROR_TYPES[_type])
+    with profiling.phase('parse_errors') as stats:
+        elements, n_lines = _parse_errors(text, tuple(error_types), prefilter)
+        stats.add(lines=n_lines, elements=len(elements))
+    return elements
+
+def _parse_errors(text, error_types, prefilter):
+    handlers = [ERROR_TYPES[_type]() for _type in error_types]
+    outputs = [[] for _ in handlers]
+    is_candidate = _candidate_filter(error_types) if prefilter else None
+    stateful = [h for h in handlers if h.STATEFUL]
 
-    # copy the input text into a secondary buffer. We expect handlers to remove
-    # lines from the buffer which they have consumed
     pos_original = text.tell()
     text.seek(0)
-    text_copy = text.readlines()
+    n_lines = 0
+    for n_lines, line in enumerate(text, 1):
+        if is_candidate is not None and not is_candidate(line) \
+           and not any(h.active for h in stateful):
+            continue
+        for handler, elements in zip(handlers, outputs):
+            if handler.feed(line, elements):
+                break
     text.seek(pos_original)
 
     ret_elements = []
-    for handler in handlers:
-        elements, removals = handler.handle(text_copy)
+    for elements in outputs:
         ret_elements.extend(elements)
-        Handler.remove_indexes(text_copy, removals)
+    return ret_elements, n_lines
 
-    return ret_elements
+@lru_cache(maxsize=None)
+def _candidate_filter(error_types):
+    """Returns a KeywordFilter of the KEYWORDS of all of the handlers in
+    `error_types`. A line which it rejects cannot be claimed by any of those
+    handlers, unless one of them is mid-way through a multi-line error.
+    """
+    keywords = []
+    for _type in error_types:
+        keywords.extend(ERROR_TYPES[_type].KEYWORDS)
+    return KeywordFilter(keywords)
 
 ############
 # Handlers #
 ############
 
 class Handler():
+    """Handlers classify console lines one at a time, through `feed()`.
 
-    @staticmethod
-    def handle(lines):
+    KEYWORDS is a list of literal strings; for a stateless handler, a line must
+    contain at least one of them (ignoring case) for `feed()` to act upon it.
+    Stateful handlers may also claim lines while they are `active`.
+    """
+
+    STATEFUL = False
+    KEYWORDS = []
+
+    @property
+    def active(self):
+        return False
+
+    def feed(self, line, elements):
+        """Examines `line`, appending any elements it yields to `elements`.
+
+        Returns: True if the line was consumed by this handler.
+        """
         raise NotImplementedError
 
+    @classmethod
+    def handle(cls, lines):
+        """Runs this handler alone over the sequence of `lines`.
+
+        Returns: tuple of (list of elements, list of consumed line indexes)
+        """
+        handler = cls()
+        elements = []
+        removals = []
+        for l in range(0, len(lines)):
+            if handler.feed(lines[l], elements):
+                removals.append(l)
+        return elements, removals
 
+    @staticmethod
     def remove_indexes(lines, removals):
-        offset = 0
-        for removal in sorted(removals):
-            del lines[removal - offset]
-            offset += 1
+        consumed = bytearray(len(lines))
+        for removal in removals:
+            consumed[removal] = 1
+        lines[:] = [line for line, c in zip(lines, consumed) if not c]
 
 class BootHandler(Handler):
     """This class looks for common boot warnings and failures about devices not
@@ -65,22 +117,16 @@ class BootHandler(Handler):
     """
     RE_NOT_FOUND = re.compile(r'\ not found', re.M | re.A | re.I)
     RE_CANNOT = re.compile(r'\b(can\'t|cannot)\b', re.M | re.I)
-
-    @staticmethod
-    def handle(lines):
-        elements = []
-        removals = []
-        for l in range(0, len(lines)):
-            line = lines[l]
-            if BootHandler.RE_NOT_FOUND.search(line):
-                elements.append(YT.Error(line, 'boot'))
-            if BootHandler.RE_CANNOT.search(line):
-                elements.append(YT.Error(line, 'boot'))
-            else:
-                continue
-            removals.append(l)
-
-        return elements, removals
+    KEYWORDS = [' not found', 'cannot', "can't"]
+
+    def feed(self, line, elements):
+        if BootHandler.RE_NOT_FOUND.search(line):
+            elements.append(YT.Error(line, 'boot'))
+        # 'not found' lines are reported, but left for later handlers
+        if BootHandler.RE_CANNOT.search(line):
+            elements.append(YT.Error(line, 'boot'))
+            return True
+        return False
 
 
 class GenericHandler(Handler):
@@ -88,79 +134,62 @@ class GenericHandler(Handler):
     RE_ERROR_GENERAL = re.compile(r'\b(error)(ed|s)?\b', re.I | re.M)
     RE_EXCEPTION_GENERAL = re.compile(r'\b(except)(ion)?\b', re.I | re.M)
     RE_WRONG_GENERAL = re.compile(r'\b(wrong)(ly)?\b', re.I | re.M)
-
-    @staticmethod
-    def handle(lines):
-        elements = []
-        removals = []
-        for l in range(0, len(lines)):
-            line = lines[l]
-            if GenericHandler.RE_ERROR_GENERAL.search(line):
-                elements.append(YT.Error(line, 'generic'))
-            elif GenericHandler.RE_FAILURE_GENERAL.search(line):
-                elements.append(YT.Failure(line, 'generic'))
-            elif GenericHandler.RE_EXCEPTION_GENERAL.search(line):
-                elements.append(YT.Error(line, 'generic'))
-            elif GenericHandler.RE_WRONG_GENERAL.search(line):
-                elements.append(YT.Error(line, 'generic'))
-            else:
-                continue
-            removals.append(l)
-
-        return elements, removals
+    KEYWORDS = ['error', 'fail', 'except', 'wrong']
+
+    def feed(self, line, elements):
+        if GenericHandler.RE_ERROR_GENERAL.search(line):
+            elements.append(YT.Error(line, 'generic'))
+        elif GenericHandler.RE_FAILURE_GENERAL.search(line):
+            elements.append(YT.Failure(line, 'generic'))
+        elif GenericHandler.RE_EXCEPTION_GENERAL.search(line):
+            elements.append(YT.Error(line, 'generic'))
+        elif GenericHandler.RE_WRONG_GENERAL.search(line):
+            elements.append(YT.Error(line, 'generic'))
+        else:
+            return False
+        return True
 
 
 class PythonHandler(Handler):
 
     RE_STACKTRACE_START = re.compile(r'^Traceback \(most recent call last\)\:')
     RE_STACKTRACE_END = re.compile(r'^\S+\:.*')
+    STATEFUL = True
+    KEYWORDS = ['traceback (most recent call last):']
 
-    @staticmethod
-    def claim(line):
-        if self.RE_STACKTRACE_START.match(line):
-            return True
-        return False
+    def __init__(self):
+        self.e_stack = None
 
-    def handle(lines):
-        elements = []
-        e_stack = None
-        removals = []
+    @property
+    def active(self):
+        return self.e_stack is not None
 
-        for l in range(0, len(lines)):
-            line = lines[l]
-            if PythonHandler.RE_STACKTRACE_START.match(line):
-                e_stack = StringIO()
-
-            if e_stack is not None:
-                if PythonHandler.RE_STACKTRACE_END.match(line):
-                    e_stack.seek(0)
-                    elements.append(YT.Error(e_stack.read(), 'salt'))
-                    e_stack = None
-                removals.append(l)
+    def feed(self, line, elements):
+        if PythonHandler.RE_STACKTRACE_START.match(line):
+            self.e_stack = StringIO()
 
-        return elements, removals
+        if self.e_stack is not None:
+            if PythonHandler.RE_STACKTRACE_END.match(line):
+                self.e_stack.seek(0)
+                elements.append(YT.Error(self.e_stack.read(), 'salt'))
+                self.e_stack = None
+            return True
+        return False
 
 
-from pprint import pprint
 class ShellHandler(Handler):
     RE_BASH_LINE = re.compile(r'^[\/\w]+\: line \d+\:.*$', re.M)
     RE_NO_FILE = re.compile(r'\bno such file\b(\sor directory)?', re.I)
-
-    @staticmethod
-    def handle(lines):
-        elements = []
-        removals = []
-        for l in range(0, len(lines)):
-            line = lines[l]
-            if ShellHandler.RE_BASH_LINE.match(line):
-                elements.append(YT.Failure(line, 'shell'))
-            elif ShellHandler.RE_NO_FILE.search(line):
-                elements.append(YT.Failure(line, 'shell'))
-            else:
-                continue
-            removals.append(l)
-
-        return elements, removals
+    KEYWORDS = [': line ', 'no such file']
+
+    def feed(self, line, elements):
+        if ShellHandler.RE_BASH_LINE.match(line):
+            elements.append(YT.Failure(line, 'shell'))
+        elif ShellHandler.RE_NO_FILE.search(line):
+            elements.append(YT.Failure(line, 'shell'))
+        else:
+            return False
+        return True
 
 
 ERROR_TYPES = {\
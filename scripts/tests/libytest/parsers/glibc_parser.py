@@ -4,14 +4,8 @@ from .ptest_parser import PTestParser
 class GlibcParser(PTestParser):
 
     OUTPUT_BIAS_ABOVE = True
+    SUITE_NAMES = ('glibc', 'glibc-tests')
 
     def __init__(self, *args, **kwargs):
         super().__init__()
         self.suite_name = 'glibc'
-
-    @classmethod
-    def is_owner(self, suite_name, suite_path, *args, **kwargs):
-        if suite_name in ['glibc', 'glibc-tests']:
-            return True
-        else:
-            return False
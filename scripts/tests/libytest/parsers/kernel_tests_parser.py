@@ -4,14 +4,8 @@ from .ptest_parser import PTestParser
 class KernelTestsParser(PTestParser):
 
     OUTPUT_BIAS_ABOVE = True
+    SUITE_NAMES = ('kernel-tests',)
 
     def __init__(self, *args, **kwargs):
         super().__init__()
         self.suite_name = 'kernel-tests'
-
-    @classmethod
-    def is_owner(self, suite_name, suite_path, *args, **kwargs):
-        if suite_name in ['kernel-tests']:
-            return True
-        else:
-            return False
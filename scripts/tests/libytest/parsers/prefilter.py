@@ -0,0 +1,40 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+
+class KeywordFilter():
+    """A case-insensitive, multi-literal line prefilter.
+
+    Calling the filter with a line returns True if the line contains any of
+    its keywords, ignoring case. It is intended to guard expensive
+    case-insensitive regexes: the keywords must be literals which every match
+    of those regexes contains, so that a False result proves that none of
+    them can match.
+
+    Lines are lowercased once and then searched for each keyword with
+    substring tests, which is several times cheaper than a single
+    case-insensitive regex search. Non-ASCII lines always pass, because
+    unicode case-insensitive regexes can match text which does not lowercase
+    to the keyword (eg. 'ſ' matches 's' under re.IGNORECASE).
+    """
+
+    def __init__(self, keywords):
+        keywords = [k.lower() for k in keywords]
+        for keyword in keywords:
+            if not keyword.isascii() or len(keyword) == 0:
+                raise ValueError("Prefilter keywords must be non-empty ASCII "
+                                 "strings. Found '{}'.".format(keyword))
+        # drop duplicates, but keep the caller's order; the most likely
+        # keywords should come first.
+        self.keywords = tuple(dict.fromkeys(keywords))
+
+    def __call__(self, line):
+        if not line.isascii():
+            return True
+        line = line.lower()
+        for keyword in self.keywords:
+            if keyword in line:
+                return True
+        return False
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, list(self.keywords))
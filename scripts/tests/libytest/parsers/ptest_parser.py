@@ -18,6 +18,13 @@ class PTestParser():
     RE_GENERAL_ERROR = re.compile(r'(.*error(?:ed)?.*)$', flags=re.IGNORECASE)
     RE_GENERAL_TIMEOUT = re.compile(r'(.*timed?-?out.*$)', flags=re.IGNORECASE)
 
+    # The error_parsers handlers which are run over the output of each test.
+    TESTCASE_ERROR_TYPES = ('generic',)
+
+    # The names of the suites which this parser owns; None for all of them.
+    # Must agree with the parser's entries in registry.BUILTIN_PARSERS.
+    SUITE_NAMES = None
+
     def __init__(self):
         self.suite_name = 'generic'
 
@@ -48,13 +55,21 @@ class PTestParser():
 
     @classmethod
     def is_owner(self, suite_name, suite_path, *args, **kwargs):
-        return True
+        return self.SUITE_NAMES is None or suite_name in self.SUITE_NAMES
 
     def _name_from_match(self, match):
         name = ' '.join(match.groups()[2:])
         return match.groups()[1]
 
-    def parse(self, console, timestamps):
+    def _prepare_console(self, console):
+        """Returns the console which the result lines are parsed from."""
+        return console
+
+    def _output_units(self, console):
+        """Splits `console` into a list of [result match, stdout] units. The
+        output which belongs to no test result is in a unit whose match is
+        None.
+        """
         console.seek(0)
 
         output_units = [[None, io.StringIO()]]
@@ -69,6 +84,10 @@ class PTestParser():
                     output_units.append([match, io.StringIO()])
             else:
                 output_units[-1][1].write(line)
+        return output_units
+
+    def parse(self, console, timestamps):
+        output_units = self._output_units(self._prepare_console(console))
 
         e_suite = YT.TestSuite(name=self.suite_name)
         for unit in output_units:
@@ -89,6 +108,30 @@ class PTestParser():
 
         return e_suite
 
+    def summarize(self, console, add_testcase):
+        """Like `parse()`, but instead of building a TestSuite, calls
+        add_testcase(classname, name, skipped, elements) with the error and
+        failure elements of each testcase which `parse()` would produce.
+        """
+        for match, stdout in self._output_units(self._prepare_console(console)):
+            if match is None:
+                stdout.seek(0)
+                elements = parse_errors(stdout, ['generic'])
+                if elements:
+                    add_testcase('.'.join([self.suite_name, 'ptest']),
+                                 'execution', False, elements)
+                continue
+
+            status = YT.norm_status(match.groups()[0])
+            elements = []
+            if status == 'FAIL':
+                stdout.seek(0)
+                elements.append(YT.Failure('FAIL', 'ptest', stdout.read()))
+            elements.extend(parse_errors(stdout, self.TESTCASE_ERROR_TYPES))
+            add_testcase(self._classname_from_match(match),
+                         self._name_from_match(match), status == 'SKIP',
+                         elements)
+
     def _parse_suite_stdout(self, e_suite, stdout):
         stdout.seek(0)
         elements = parse_errors(stdout, ['generic'])
@@ -121,7 +164,7 @@ class PTestParser():
             e_test.skipped = True
 
     def _parse_test_stdout(self, e_test, match, stdout):
-        elements = parse_errors(stdout, ['generic'])
+        elements = parse_errors(stdout, self.TESTCASE_ERROR_TYPES)
         e_test.add_children(elements)
 
         stdout.seek(0)
@@ -135,3 +178,4 @@ class PTestParser():
             if timestamps[1] is not None:
                 delta = timestamps[1] - timestamps[0]
                 e_suite.set('time', delta)
+                e_suite.wall_time = delta
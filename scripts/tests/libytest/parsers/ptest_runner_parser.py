@@ -4,12 +4,171 @@ import os.path
 import re
 
 from .. import libytest as YT
+from .. import profiling
+from ..console_source import ConsoleView
+
+from .registry import default_registry
+
+class PTestSuiteBlock():
+    """The console of a single ptest, as delimited by the ptest-runner BEGIN
+    and END/TIMEOUT lines, along with the runner metadata which surrounds it.
+    """
+
+    def __init__(self, name, path, ts_start=None):
+        self.name = name
+        self.path = path
+        self.console = None  # set once the END/TIMEOUT line is found
+        self.timeout = False
+        self.ts_start = ts_start
+        self.ts_end = None
+
+    @property
+    def timestamps(self):
+        return (self.ts_start, self.ts_end)
+
+    def detach(self):
+        """Replaces the block's console with an in-memory copy, so that the
+        block no longer references its source and can be pickled.
+        """
+        self.console.seek(0)
+        self.console = io.StringIO(self.console.read())
+        return self
+
+
+class PTestRunnerTokenizer():
+    """A line-fed state machine which splits a console log into ptest-runner
+    events in a single forward read. Every call to `feed()` and `close()`
+    returns a (possibly empty) list of `(event, payload)` tuples, where
+    `event` is one of:
+
+    EV_CONSOLE: payload is a console of the text which lies outside of a
+                ptest-runner segment. Emitted before each runner segment and
+                once more when the tokenizer is closed.
+    EV_RUNNER_START: payload is None.
+    EV_SUITE: payload is a completed PTestSuiteBlock.
+    EV_RUNNER_END: payload is None.
+
+    If a `source` ConsoleView is given, every line must be fed with its
+    (start, end) offsets in that source, and the emitted consoles are
+    zero-copy views into it. Otherwise, the tokenizer buffers the lines it is
+    fed and emits io.StringIO consoles.
+    """
+
+    EV_CONSOLE = 'console'
+    EV_RUNNER_START = 'runner-start'
+    EV_SUITE = 'suite'
+    EV_RUNNER_END = 'runner-end'
+
+    # runner states
+    _OUTSIDE = 0
+    _WANT_TS_START = 1
+    _WANT_BEGIN = 2
+    _IN_SUITE = 3
+    _WANT_TS_END = 4
+
+    def __init__(self, parser_type=None, source=None):
+        # the regexes are borrowed from the parser class, so that subclasses
+        # of PTestRunnerParser may override them.
+        self.parser_type = parser_type or PTestRunnerParser
+        self.source = source
+        self._state = self._OUTSIDE
+        self._block = None
+        self._ts_start = None
+        # console (non-runner) text accumulators
+        self._lines = []
+        self._pos = source.start if source is not None else 0
+        self._span_start = self._pos
+
+    def close(self):
+        """Flushes any incomplete runner segment and the trailing console
+        text.
+        """
+        events = []
+        if self._state != self._OUTSIDE:
+            self._end_runner(events, self._pos)
+        events.append((self.EV_CONSOLE, self._take_console(self._pos)))
+        return events
+
+    def _end_runner(self, events, end):
+        # An unterminated suite is still reported; it simply has no ending
+        # timestamp.
+        if self._block is not None:
+            if self._state == self._IN_SUITE:
+                self._block.console = self._take_console(end)
+            events.append((self.EV_SUITE, self._block))
+            self._block = None
+        self._state = self._OUTSIDE
+        self._span_start = end
+        events.append((self.EV_RUNNER_END, None))
+
+    def feed(self, line, start=None, end=None):
+        events = []
+        ptype = self.parser_type
+        state = self._state
+        if end is not None:
+            self._pos = end
+
+        if state == self._OUTSIDE:
+            if ptype.RE_RUNNER_START.match(line):
+                events.append((self.EV_CONSOLE, self._take_console(start)))
+                events.append((self.EV_RUNNER_START, None))
+                self._state = self._WANT_TS_START
+            elif self.source is None:
+                self._lines.append(line)
+            return events
+
+        if ptype.RE_RUNNER_END.match(line):
+            self._end_runner(events, start)
+            self._span_start = end
+            return events
+
+        if state == self._IN_SUITE:
+            clean = ptype.clean_ansi_control(line) if '\x1b' in line else line
+            if clean.startswith(('END:', 'TIMEOUT:')):
+                if ptype.RE_PTEST_TIMEOUT.match(clean):
+                    self._block.timeout = True
+                elif not ptype.RE_PTEST_END.match(clean):
+                    clean = None
+                if clean is not None:
+                    self._block.console = self._take_console(start)
+                    self._state = self._WANT_TS_END
+                    return events
+            if self.source is None:
+                self._lines.append(line)
+        elif state == self._WANT_TS_START or state == self._WANT_TS_END:
+            ts = ptype.match_timestamp(line)
+            if ts is None:
+                return events
+            if state == self._WANT_TS_START:
+                self._ts_start = ts
+                self._state = self._WANT_BEGIN
+            else:
+                self._block.ts_end = ts
+                events.append((self.EV_SUITE, self._block))
+                self._block = None
+                self._state = self._WANT_TS_START
+        elif state == self._WANT_BEGIN:
+            clean = ptype.clean_ansi_control(line) if '\x1b' in line else line
+            match = ptype.RE_PTEST_START.match(clean)
+            if match:
+                name, path = ptype.split_suite_path(match.group(1))
+                self._block = PTestSuiteBlock(name, path, self._ts_start)
+                self._span_start = end
+                self._state = self._IN_SUITE
+        return events
+
+    def _take_console(self, end):
+        """Returns the console text accumulated since the last take, and
+        resets the accumulator.
+        """
+        if self.source is not None:
+            console = self.source.view(self._span_start, end)
+        else:
+            console = io.StringIO(''.join(self._lines))
+            self._lines = []
+        self._span_start = end
+        return console
 
-from .glibc_parser import GlibcParser
-from .kernel_tests_parser import KernelTestsParser
-from .ptest_parser import PTestParser
-from .rt_tests_parser import RTTestsParser
-from .salt_tests_parser import SaltTestsParser
 
 class PTestRunnerParser():
 
@@ -23,13 +182,8 @@ class PTestRunnerParser():
 
     RE_ANSI_ESCAPE = re.compile(r'\x1b[^m]*m')
 
-    PTEST_PARSER_TYPES = [\
-        GlibcParser,
-        KernelTestsParser,
-        RTTestsParser,
-        SaltTestsParser,
-        PTestParser,  # must be the last in this sequence
-    ]
+    # suite name -> PTestParser type; see parsers.registry
+    PARSER_REGISTRY = default_registry()
 
     def __init__(self):
         pass
@@ -41,9 +195,7 @@ class PTestRunnerParser():
         e_suite.test_cases.append(e_tc_timeliness)
 
     def choose_parser(self, suite_name, suite_path):
-        for type_ in self.PTEST_PARSER_TYPES:
-            if type_.is_owner(suite_name, suite_path):
-                return type_
+        return self.PARSER_REGISTRY.lookup(suite_name, suite_path)
 
     @classmethod
     def clean_ansi_control(self, line):
@@ -54,20 +206,13 @@ class PTestRunnerParser():
         for line in console:
             match = self.RE_PTEST_START.match(line)
             if match:
-                path = match.group(1)
-                path, tail = os.path.split(path)
-                if tail == 'ptest':
-                    return os.path.basename(path), match.group(1)
-                else:
-                    return tail, match.group(1)
+                return self.split_suite_path(match.group(1))
 
     @classmethod
     def extract_timestamp(self, console):
         for line in console:
-            match = self.RE_RUNNER_TIMESTAMP.match(line)
-            if match:
-                groups = [int(t) for t in match.groups() if t is not None]
-                ts = datetime.datetime(*groups).timestamp()
+            ts = self.match_timestamp(line)
+            if ts is not None:
                 return ts
         return None
 
@@ -96,6 +241,22 @@ class PTestRunnerParser():
 
         return segments
 
+    def iter_events(self, console):
+        """Tokenizes `console` in a single forward read, yielding the
+        `(event, payload)` tuples documented on PTestRunnerTokenizer.
+        `console` may be a text stream or a ConsoleView; the latter is walked
+        without copying.
+        """
+        if isinstance(console, ConsoleView):
+            tokenizer = PTestRunnerTokenizer(type(self), source=console)
+            for start, end, line in console.iter_lines():
+                yield from tokenizer.feed(line, start, end)
+        else:
+            tokenizer = PTestRunnerTokenizer(type(self))
+            for line in console:
+                yield from tokenizer.feed(line)
+        yield from tokenizer.close()
+
     def is_timeout(self, console):
         for line in console:
             line = self.RE_ANSI_ESCAPE.sub('', line)
@@ -103,57 +264,54 @@ class PTestRunnerParser():
                 return True
         return False
 
+    @classmethod
+    def match_timestamp(self, line):
+        match = self.RE_RUNNER_TIMESTAMP.match(line)
+        if match:
+            groups = [int(t) for t in match.groups() if t is not None]
+            return datetime.datetime(*groups).timestamp()
+        return None
+
     def parse(self, console):
+        """Parses the first ptest-runner segment in `console`."""
         console.seek(0)
-        # pre-runner
-        subconsole = self.read_until(console, self.RE_RUNNER_START, False)
-        # PTEST RUNNER
-        # consume, but do not use, the START: line
-        self.read_until(console, self.RE_RUNNER_START)
-        subconsole = self.read_until(console, self.RE_RUNNER_END, False)
-        e_suites = self._parse_runner(subconsole)
-        # post-runner (Do nothing)
-        return e_suites
-
-    def _parse_runner(self, console, name='ptests'):
         e_suites = YT.TestSuites()
-        suite_id = 0
-        while True:
-            timeout = False
-            # Starting Timestamp
-            ts_start = self.extract_timestamp(console)
-            if ts_start is None:
+        for event, payload in self.iter_events(console):
+            if event == PTestRunnerTokenizer.EV_SUITE:
+                e_suites.test_suites.append(
+                    self.parse_suite_block(payload, len(e_suites.test_suites)))
+            elif event == PTestRunnerTokenizer.EV_RUNNER_END:
                 break
-            # Ptest START
-            subconsole = self.read_until(console, self.RE_PTEST_START)
-            suite_name, suite_path = self.extract_suite_name(subconsole)
-            # Ptest stdout
-            parser_type = self.choose_parser(suite_name, suite_path)
-            subconsole = self.read_until(console, (self.RE_PTEST_END,
-                                                   self.RE_PTEST_TIMEOUT),
-                                                   False)
-            # PTest END/TIMEOUT
-            if self.is_timeout(self.read_until(console, (self.RE_PTEST_END,
-                                                         self.RE_PTEST_TIMEOUT),
-                                                         True)):
-                timeout = True
-            # Ending Timestamp
-            ts_end = self.extract_timestamp(console)
-            if ts_start is None:
-                raise RuntimeError("Malformed ptest runner output")
-            # Parse Ptest
-            parser = parser_type()
-            parser.suite_name = suite_name
-            e_suite = parser.parse(subconsole, (ts_start, ts_end))
-            if timeout:
+        e_suites.set('name', 'ptests')
+        return e_suites
+
+    def parse_suite_block(self, block, suite_id):
+        """Runs a PTestSuiteBlock through the PTestParser which owns it, and
+        returns the resulting TestSuite element.
+        """
+        parser = self.choose_parser(block.name, block.path)()
+        parser.suite_name = block.name
+        with profiling.phase('suite_parser:' + type(parser).__name__) as stats:
+            e_suite = parser.parse(block.console, block.timestamps)
+            if block.timeout:
                 self.add_timeout_failure(parser, e_suite)
-            # Cleanup and save
-            e_suite.set('id', suite_id)
-            suite_id += 1
-            e_suites.test_suites.append(e_suite)
+            if profiling.active() is not None:
+                stats.add(suites=1, lines=profiling.count_lines(block.console),
+                          testcases=len(e_suite.test_cases))
+        e_suite.set('id', suite_id)
+        return e_suite
 
-        e_suites.set('name', name)
-        return e_suites
+    def summarize_suite_block(self, block, add_testcase):
+        """Like `parse_suite_block()`, but reports the testcases of the suite
+        through add_testcase(classname, name, skipped, elements) (see
+        PTestParser.summarize()) instead of building a TestSuite.
+        """
+        parser = self.choose_parser(block.name, block.path)()
+        parser.suite_name = block.name
+        parser.summarize(block.console, add_testcase)
+        if block.timeout:
+            add_testcase('.'.join([parser.suite_name, 'ptest']), 'timeliness',
+                         False, [YT.Failure('timeout', 'ptest')])
 
     @classmethod
     def read_until(self, console, re_stops, inclusive=True):
@@ -194,6 +352,23 @@ class PTestRunnerParser():
         subconsole.seek(0)
         return subconsole
 
+    def submit_suite_block(self, executor, block, suite_id):
+        """Like `parse_suite_block()`, but the parsing is done by `executor`
+        (a concurrent.futures.ProcessPoolExecutor). Returns a future of the
+        `YT.pack_testsuite()` bytes of the resulting TestSuite.
+        """
+        return executor.submit(_parse_suite_block_packed, type(self),
+                               block.detach(), suite_id)
+
+    @classmethod
+    def split_suite_path(self, path):
+        """Returns the (suite name, suite path) of a ptest BEGIN path."""
+        head, tail = os.path.split(path)
+        if tail == 'ptest':
+            return os.path.basename(head), path
+        else:
+            return tail, path
+
     @classmethod
     def subconsole(self, source, end, start=None):
         subconsole = io.StringIO()
@@ -221,3 +396,8 @@ class PTestRunnerParser():
             marker = source.tell()
             line = source.readline()
         return None
+
+
+def _parse_suite_block_packed(parser_type, block, suite_id):
+    """Process pool entry point for `submit_suite_block()`."""
+    return YT.pack_testsuite(parser_type().parse_suite_block(block, suite_id))
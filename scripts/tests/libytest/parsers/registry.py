@@ -0,0 +1,139 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# The ptest suite parsers, by the names of the suites they own. Parsers are
+# registered as 'module:Class' references and their modules are only imported
+# once a suite of theirs is parsed. Suites which no parser owns fall back to
+# the generic PTestParser.
+#
+# Out-of-tree parsers are registered through the 'libytest.ptest_parsers'
+# entry point group, where each entry point is named after a suite which it
+# parses, eg.:
+#   [project.entry-points."libytest.ptest_parsers"]
+#   openssl = "nilrt_parsers.openssl:OpenSSLParser"
+# Entry points are only consulted for suites which no built-in parser owns.
+
+import importlib
+
+ENTRY_POINT_GROUP = 'libytest.ptest_parsers'
+
+# suite name -> parser; each parser's SUITE_NAMES must be exactly the names
+# it is listed under, which the registry checks as it loads the parser
+BUILTIN_PARSERS = {
+    'glibc':            '.glibc_parser:GlibcParser',
+    'glibc-tests':      '.glibc_parser:GlibcParser',
+    'kernel-tests':     '.kernel_tests_parser:KernelTestsParser',
+    'rt-tests':         '.rt_tests_parser:RTTestsParser',
+    'salt':             '.salt_tests_parser:SaltTestsParser',
+    'salt-testing':     '.salt_tests_parser:SaltTestsParser',
+    'salt-tests':       '.salt_tests_parser:SaltTestsParser',
+    'salt-ptests':      '.salt_tests_parser:SaltTestsParser',
+}
+FALLBACK_PARSER = '.ptest_parser:PTestParser'
+
+
+def load_parser(ref):
+    """Returns the parser class of a 'module:Class' reference. Relative
+    module names are resolved against this package.
+    """
+    module_name, _, class_name = ref.partition(':')
+    module = importlib.import_module(module_name, package=__package__)
+    return getattr(module, class_name)
+
+def _iter_entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # python < 3.8
+        return []
+    try:
+        return entry_points(group=group)
+    except TypeError:  # python < 3.10
+        return entry_points().get(group, [])
+
+
+class ParserRegistry():
+    """Maps ptest suite names to their parser classes.
+
+    Parsers may be registered as classes or as 'module:Class' references,
+    which are loaded on first use. Parsers which must see the suite path to
+    tell whether they own a suite are registered with `register_owner()`, and
+    have their `is_owner()` consulted for the suites which no name owns.
+
+    A parser whose SUITE_NAMES are set must be registered under exactly those
+    names; a ValueError is raised when it is loaded otherwise.
+    """
+
+    def __init__(self, parsers=None, fallback=FALLBACK_PARSER,
+                 entry_point_group=ENTRY_POINT_GROUP):
+        self._parsers = dict(parsers or {})
+        self._owners = []
+        self._fallback = fallback
+        self._entry_point_group = entry_point_group
+        self._entry_points = None
+
+    def register(self, suite_names, parser):
+        """Registers `parser` as the parser of each of `suite_names`."""
+        if isinstance(suite_names, str):
+            suite_names = [suite_names]
+        for suite_name in suite_names:
+            self._parsers[suite_name] = parser
+
+    def register_owner(self, parser):
+        self._owners.append(parser)
+
+    def _resolve(self, parser):
+        if isinstance(parser, str):
+            return load_parser(parser)
+        if hasattr(parser, 'load'):  # an importlib.metadata.EntryPoint
+            return parser.load()
+        return parser
+
+    def _get(self, table, key):
+        entry = table[key]
+        parser = self._resolve(entry)
+        if table is self._parsers and parser is not entry:
+            self._check_suite_names(parser, entry)
+        table[key] = parser
+        return parser
+
+    def _check_suite_names(self, parser, entry):
+        owned = getattr(parser, 'SUITE_NAMES', None)
+        if owned is None:
+            return
+        names = [name for name, p in self._parsers.items()
+                 if p == entry or p is parser]
+        if sorted(names) != sorted(owned):
+            raise ValueError('%s owns the suites %s, but is registered for %s'
+                             % (parser.__name__, sorted(owned), sorted(names)))
+
+    def _load_entry_points(self):
+        self._entry_points = {}
+        if self._entry_point_group is None:
+            return
+        for entry_point in _iter_entry_points(self._entry_point_group):
+            self._entry_points.setdefault(entry_point.name, entry_point)
+
+    def lookup(self, suite_name, suite_path=None):
+        """Returns the parser class of the suite `suite_name`."""
+        if suite_name in self._parsers:
+            return self._get(self._parsers, suite_name)
+
+        for i in range(len(self._owners)):
+            owner = self._get(self._owners, i)
+            if owner.is_owner(suite_name, suite_path):
+                return owner
+
+        if self._entry_points is None:
+            self._load_entry_points()
+        if suite_name in self._entry_points:
+            parser = self._resolve(self._entry_points[suite_name])
+            self._parsers[suite_name] = parser
+            return parser
+
+        if isinstance(self._fallback, str):
+            self._fallback = load_parser(self._fallback)
+        return self._fallback
+
+
+def default_registry():
+    """Returns a new registry of the built-in parsers."""
+    return ParserRegistry(BUILTIN_PARSERS)
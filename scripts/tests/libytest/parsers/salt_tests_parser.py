@@ -10,9 +10,11 @@ class SaltTestsParser(PTestParser):
     """Parses the salt-testing ptest output."""
 
     OUTPUT_BIAS_ABOVE = False
+    SUITE_NAMES = ('salt', 'salt-testing', 'salt-tests', 'salt-ptests')
     RE_RESULT_NAME = re.compile(r'^([^\(]+)\s\(([^\)]+)\)')
     # these headings are really annoying
     RE_HEADING = re.compile(r'^~+', re.M)
+    TESTCASE_ERROR_TYPES = ('python', 'generic')
 
     def __init__(self, *args, **kwargs):
         super().__init__()
@@ -22,17 +24,10 @@ class SaltTestsParser(PTestParser):
         name_match = self.RE_RESULT_NAME.match(match.groups()[1])
         return '.'.join([self.suite_name, name_match.groups()[1]])
 
-    @classmethod
-    def is_owner(self, suite_name, suite_path, *args, **kwargs):
-        if suite_name in ['salt', 'salt-testing', 'salt-tests', 'salt-ptests']:
-            return True
-        else:
-            return False
-
     def _name_from_match(self, match):
         return self.RE_RESULT_NAME.match(match.groups()[1]).groups()[0]
 
-    def parse(self, console, timestamps):
+    def _prepare_console(self, console):
         # remove the annoying salt headings from the test output
         subconsole = io.StringIO()
         console.seek(0)
@@ -46,11 +41,10 @@ class SaltTestsParser(PTestParser):
                     in_heading = True
             if not in_heading:
                 subconsole.write(line)
-
-        return super().parse(subconsole, timestamps)
+        return subconsole
 
     def _parse_test_stdout(self, e_test, match, stdout):
-        elements = parse_errors(stdout, ['python', 'generic'])
+        elements = parse_errors(stdout, self.TESTCASE_ERROR_TYPES)
         e_test.add_children(elements)
 
         stdout.seek(0)
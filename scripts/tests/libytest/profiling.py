@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# vi: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# Instrumentation of the parsing stack. A Profiler records the wall time,
+# call count and counters (lines, elements, bytes...) of named phases, and
+# the peak RSS of the process as each phase ends. The instrumented code
+# reports to the active Profiler, if one has been enabled; otherwise, each
+# instrumentation point only costs a global lookup.
+#
+#   profiler = profiling.enable()
+#   with profiling.phase('mask') as stats:
+#       removals = mask.mask_expectations(e_suites)
+#       stats.add(removals=len(removals))
+#   profiling.disable()
+#   profiler.write_json('profile.json')
+
+import contextlib
+import io
+import json
+import resource
+import sys
+import time
+
+_active = None
+
+
+def peak_rss_kib():
+    """Returns the peak resident set size of this process, in KiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024  # bytes on macOS
+    return rss
+
+
+def count_lines(console):
+    """Returns the number of lines in the text stream `console`, without
+    moving its position.
+    """
+    if hasattr(console, 'count_lines'):
+        return console.count_lines()
+    if isinstance(console, io.StringIO):
+        text = console.getvalue()
+        return text.count('\n') + (not text.endswith('\n') and text != '')
+    pos = console.tell()
+    console.seek(0)
+    n_lines = sum(1 for _ in console)
+    console.seek(pos)
+    return n_lines
+
+
+class PhaseStats():
+    """The accumulated measurements of every run of one phase.
+
+    `wall_time` includes the time spent in the phases which were nested in
+    it; `self_time` does not.
+    """
+
+    __slots__ = ('name', 'calls', 'wall_time', 'self_time', 'counts',
+                 'peak_rss_kib')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.self_time = 0.0
+        self.counts = {}
+        self.peak_rss_kib = 0
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'wall_time': self.wall_time,
+            'self_time': self.self_time,
+            'counts': dict(self.counts),
+            'peak_rss_kib': self.peak_rss_kib,
+        }
+
+
+class _NullPhaseStats():
+    """Stands in for a PhaseStats when no profiler is active."""
+
+    def add(self, **counts):
+        pass
+
+
+_NULL_PHASE = contextlib.nullcontext(_NullPhaseStats())
+
+
+class Profiler():
+    """Collects the PhaseStats of named phases, in the order they first ran.
+    Phases may be nested, but a Profiler must only be used from one thread.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._nested = []  # time spent in the children of each open phase
+        self.t_start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name, **counts):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = PhaseStats(name)
+        stats.calls += 1
+        stats.add(**counts)
+
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.wall_time += elapsed
+            stats.self_time += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            stats.peak_rss_kib = peak_rss_kib()
+
+    def report(self):
+        """Returns the measurements as a JSON-serializable dict."""
+        return {
+            'wall_time': time.perf_counter() - self.t_start,
+            'peak_rss_kib': peak_rss_kib(),
+            'phases': [stats.to_dict() for stats in self.phases.values()],
+        }
+
+    def write_json(self, filepath):
+        with open(filepath, 'w') as fp:
+            json.dump(self.report(), fp, indent=1)
+            fp.write('\n')
+
+
+def active():
+    """Returns the active Profiler, or None."""
+    return _active
+
+def enable(profiler=None):
+    """Makes `profiler` (or a new Profiler) the active one, and returns it."""
+    global _active
+    _active = profiler if profiler is not None else Profiler()
+    return _active
+
+def disable():
+    global _active
+    _active = None
+
+def phase(name, **counts):
+    """Returns a context manager which measures a run of the phase `name` in
+    the active profiler, if there is one. It yields the phase's PhaseStats,
+    to which further counts may be added.
+    """
+    if _active is None:
+        return _NULL_PHASE
+    return _active.phase(name, **counts)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# vi: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# Counts-only console parsing. A ConsoleSummary runs the same parsers as a
+# full parse, but folds each testcase into the pass/fail/skip counters of its
+# suite as soon as it is parsed (and masked), instead of building the element
+# tree. It gives the same digests as the full parse, at a fraction of the time
+# and memory, and without loading lxml.
+
+import json
+
+from .parsers import PTestRunnerParser, PTestRunnerTokenizer, ConsoleParser
+from . import libytest as YT
+
+
+class SuiteSummary():
+    """The counts of one testsuite, as they would be in its TestSuite."""
+
+    __slots__ = ('name', 'tests', 'failures', 'errors', 'skipped',
+                 'wall_time', 'console_name')
+
+    def __init__(self, name, wall_time=None, console_name=None):
+        self.name = YT.sanitize_str_xml(name)
+        self.tests = 0
+        self.failures = 0
+        self.errors = 0
+        self.skipped = 0
+        self.wall_time = wall_time
+        self.console_name = console_name
+
+    @property
+    def passed(self):
+        return self.tests - self.failures - self.skipped
+
+    def add_testcase(self, testcase):
+        self.tests += 1
+        self.errors += int(bool(testcase.errors))
+        self.failures += int(bool(testcase.failures))
+        self.skipped += int(testcase.skipped)
+
+    def get_digest(self):
+        return ("{:20} | total= {:5} | (P/F/S)=({:3}/{:3}/{:3})"
+                .format(self.name, self.tests, self.passed, self.failures,
+                        self.skipped))
+
+    def get_digest_grep(self):
+        values = [str(x) for x in [self.name, self.tests, self.passed,
+                                   self.failures, self.skipped]]
+        return " ".join(values)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'console': self.console_name,
+            'tests': self.tests,
+            'passed': self.passed,
+            'failures': self.failures,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'wall_time': self.wall_time,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+
+class CaseRecord():
+    """The results of a single testcase, for as long as it takes to mask and
+    count it. Masks apply to it as they do to a TestCase.
+    """
+
+    __slots__ = ('classname', 'name', 'skipped', 'errors', 'failures')
+
+    def __init__(self, classname, name, skipped, elements):
+        # as Element.set() would store them
+        self.classname = YT.sanitize_str_xml(classname)
+        self.name = YT.sanitize_str_xml(name)
+        self.skipped = skipped
+        self.errors = []
+        self.failures = []
+        for element in elements:
+            if isinstance(element, YT.Error):
+                self.errors.append(element)
+            elif isinstance(element, YT.Failure):
+                self.failures.append(element)
+
+    def get(self, attr):
+        if attr == 'classname':
+            return self.classname
+        if attr == 'name':
+            return self.name
+        raise KeyError(attr)
+
+    def eval_status(self):
+        """Does nothing: a record has no status, SuiteSummary derives it."""
+
+
+class ConsoleSummary():
+    """Builds the SuiteSummaries of a console from the `(event, payload)`
+    tuples of a PTestRunnerTokenizer, like ConsoleResults does TestSuites.
+    """
+
+    def __init__(self, ptest_only=False, mask=None, console_name=None):
+        self.parser_console = ConsoleParser()
+        self.parser_runner = PTestRunnerParser()
+        self.ptest_only = ptest_only
+        self.mask = mask
+        self.console_name = console_name
+        self.removals = []
+        self._summaries = []
+        # the general console testcases, merged by (classname, name)
+        self._console_cases = {}
+
+    def _add_testcase(self, summary, record):
+        if self.mask is not None:
+            self.removals.extend(self.mask.mask_testcase(summary.name, record))
+        summary.add_testcase(record)
+
+    def handle_event(self, event, payload):
+        if event == PTestRunnerTokenizer.EV_SUITE:
+            wall_time = None
+            if payload.ts_start is not None and payload.ts_end is not None:
+                wall_time = payload.ts_end - payload.ts_start
+            summary = SuiteSummary(payload.name, wall_time, self.console_name)
+            self.parser_runner.summarize_suite_block(payload,
+                lambda *case: self._add_testcase(summary, CaseRecord(*case)))
+            self._summaries.append(summary)
+        elif event == PTestRunnerTokenizer.EV_CONSOLE and not self.ptest_only:
+            self.parser_console.summarize(payload, self._add_console_case)
+
+    def _add_console_case(self, classname, name, skipped, elements):
+        record = self._console_cases.get((classname, name))
+        if record is None:
+            record = CaseRecord(classname, name, True, ())
+            self._console_cases[(classname, name)] = record
+        if not skipped:
+            record.skipped = False
+        merged = CaseRecord(classname, name, skipped, elements)
+        record.errors.extend(merged.errors)
+        record.failures.extend(merged.failures)
+
+    def result(self):
+        """Returns the SuiteSummaries of the ptest suites, followed by that of
+        the general console suite. Call it once, after the last event.
+        """
+        summaries = list(self._summaries)
+        if not self.ptest_only:
+            summary = SuiteSummary(ConsoleParser.SUITE_NAME,
+                                   console_name=self.console_name)
+            for record in self._console_cases.values():
+                self._add_testcase(summary, record)
+            summaries.append(summary)
+        return summaries
+
+
+def summarize_console(console, ptest_only=False, mask=None,
+                      console_name=None):
+    """Returns the ConsoleSummary of the text stream or ConsoleView
+    `console`, once it has been walked.
+    """
+    summary = ConsoleSummary(ptest_only, mask, console_name)
+    console.seek(0)
+    for event, payload in summary.parser_runner.iter_events(console):
+        summary.handle_event(event, payload)
+    return summary
+
+def get_digest(summaries, name=''):
+    """Returns the digest of all of `summaries`, as TestSuites.get_digest()
+    would give it.
+    """
+    passed = sum(summary.passed for summary in summaries)
+    failures = sum(summary.failures for summary in summaries)
+    skipped = sum(summary.skipped for summary in summaries)
+    return ("{:26} | {:^5} test suites | (P/F/S)=({}/{}/{})"
+            .format(name, len(summaries), passed, failures, skipped))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# vi: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ---
+# Synthetic ptest-runner consoles, for benchmarking the parsers. The consoles
+# mimic the logs of real NILRT test VMs: boot noise, then ptest-runner
+# segments of glibc-style PASS/FAIL/SKIP lines, salt-ptests with `~~~`
+# headings and Python tracebacks, rt-tests, kernel-tests, generic suites,
+# ANSI colour codes and TIMEOUT blocks. Output is deterministic for a given
+# seed. Run from the scripts/tests directory, like:
+#   python3 -m libytest.synthetic -s 16M console.log
+
+import argparse
+import datetime
+import random
+import re
+import sys
+
+RE_SIZE = re.compile(r'^(\d+)([KMG]?)$', re.I)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+BOOT_LINES = [
+    '[{t:12.6f}] Linux version 4.14.146-rt67 (oe-user@oe-host) #1 SMP PREEMPT RT\n',
+    '[{t:12.6f}] usb 1-1: new high-speed USB device number {n} using ehci-pci\n',
+    '[{t:12.6f}] EXT4-fs (sda{n}): mounted filesystem with ordered data mode\n',
+    '[{t:12.6f}] nirtcfg: device ni-rt-{n} not found\n',
+    '[{t:12.6f}] systemd[1]: Started Journal Service.\n',
+    'Starting syslogd/klogd: done\n',
+    'mount: cannot mount /dev/mmcblk0p{n} read-only\n',
+    '[  OK  ] Reached target Multi-User System.\n',
+    '[FAILED] Failed to start NI System Web Server {n}.\n',
+    'modprobe: FATAL: Module nikal not found in directory /lib/modules\n',
+]
+
+GENERIC_SUITES = ['busybox', 'openssl', 'openssh', 'python3', 'perl',
+                  'bash', 'util-linux', 'libxml2', 'zlib', 'e2fsprogs']
+
+GLIBC_DIRS = ['nptl', 'math', 'string', 'stdio-common', 'malloc', 'posix',
+              'elf', 'time', 'resolv', 'iconvdata']
+
+PYTHON_MODULES = ['tests.unit.modules.test_file', 'tests.unit.states.test_pkg',
+                  'tests.unit.utils.test_network', 'tests.integration.shell',
+                  'tests.unit.grains.test_core']
+
+
+def parse_size(text):
+    """Returns the number of bytes of a size like '512K', '16M' or '1G'."""
+    match = RE_SIZE.match(text.strip())
+    if not match:
+        raise ValueError('invalid size: %r' % text)
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+class ConsoleGenerator():
+    """Writes synthetic ptest-runner consoles.
+
+    `fail_rate` and `skip_rate` are the fractions of the testcases which fail
+    and are skipped; `timeout_rate` is the fraction of the suites which time
+    out.
+    """
+
+    def __init__(self, seed=0, fail_rate=0.05, skip_rate=0.05,
+                 timeout_rate=0.05):
+        self.random = random.Random(seed)
+        self.fail_rate = fail_rate
+        self.skip_rate = skip_rate
+        self.timeout_rate = timeout_rate
+        self._clock = datetime.datetime(2020, 1, 1, 8, 0, 0)
+        self._uptime = 0.0
+        self.suite_generators = [
+            ('glibc', self._glibc_tests, 2000),
+            ('salt', self._salt_tests, 300),
+            ('rt-tests', self._rt_tests, 20),
+            ('kernel-tests', self._kernel_tests, 100),
+        ] + [(name, self._generic_tests, 60) for name in GENERIC_SUITES]
+
+    def _outcome(self):
+        r = self.random.random()
+        if r < self.fail_rate:
+            return 'FAIL'
+        if r < self.fail_rate + self.skip_rate:
+            return 'SKIP'
+        return 'PASS'
+
+    def _timestamp(self, seconds, with_seconds=True):
+        self._clock += datetime.timedelta(seconds=seconds)
+        if with_seconds:
+            return self._clock.strftime('%Y-%m-%dT%H:%M:%S\n')
+        return self._clock.strftime('%Y-%m-%dT%H:%M\n')
+
+    def _colour(self, text):
+        if self.random.random() < 0.1:
+            return '\x1b[31m%s\x1b[0m' % text
+        return text
+
+    def boot_noise(self, n_lines):
+        """Yields `n_lines` of kernel, systemd and init output."""
+        for _ in range(n_lines):
+            self._uptime += self.random.random() * 0.05
+            yield self.random.choice(BOOT_LINES).format(
+                t=self._uptime, n=self.random.randrange(8))
+
+    def _glibc_tests(self, name, n_tests):
+        for i in range(n_tests):
+            test = '%s/tst-%s%d' % (self.random.choice(GLIBC_DIRS),
+                                    name.split('-')[0], i)
+            outcome = self._outcome()
+            if outcome == 'FAIL':
+                yield "Didn't expect signal from child: got `Segmentation fault'\n"
+                yield 'error: %s.c:%d: not true: ret == 0\n' % (test, 40 + i % 200)
+            elif self.random.random() < 0.2:
+                yield 'original exit status %d\n' % (i % 3)
+            yield self._colour('%s: %s\n' % (outcome, test))
+
+    def _salt_tests(self, name, n_tests):
+        # salt-ptests print their results above the output of the test
+        for i in range(n_tests):
+            module = self.random.choice(PYTHON_MODULES)
+            subject = module.rsplit('.', 1)[-1].replace('test_', '')
+            test = 'test_%s_%d' % (subject, i)
+            if self.random.random() < 0.3:
+                yield '~' * 70 + '\n'
+                yield ' Setting up %s\n' % module
+                yield '~' * 70 + '\n'
+            outcome = self._outcome()
+            yield '%s: %s (%s.%sTestCase)\n' % (outcome, test, module,
+                                                subject.title())
+            if outcome == 'FAIL':
+                yield 'Traceback (most recent call last):\n'
+                yield '  File "/usr/lib/salt/ptest/%s.py", line %d, in %s\n' \
+                    % (module.replace('.', '/'), 100 + i, test)
+                yield '    self.assertEqual(ret, expected)\n'
+                yield "AssertionError: {'result': False} != {'result': True}\n"
+            elif self.random.random() < 0.3:
+                yield '[INFO    ] Executing command %r in directory /root\n' \
+                    % ('ls -l /tmp/%d' % i)
+
+    def _rt_tests(self, name, n_tests):
+        for i in range(n_tests):
+            test = self.random.choice(['cyclictest', 'hackbench', 'pi_stress',
+                                       'signaltest', 'ptsematest']) + str(i)
+            for cpu in range(4):
+                yield 'T:%2d (%5d) P:98 I:1000 C: %7d Min: %5d Act: %5d ' \
+                      'Avg: %5d Max: %7d\n' % (cpu, 1000 + cpu, 60000 + i,
+                      3, 5 + cpu, 6, 20 + self.random.randrange(200))
+            outcome = self._outcome()
+            if outcome == 'FAIL':
+                yield 'Max latency exceeded the 100us threshold\n'
+            yield '%s: %s\n' % (outcome, test)
+
+    def _kernel_tests(self, name, n_tests):
+        for i in range(n_tests):
+            test = 'test_kernel_%s_%d' % (self.random.choice(
+                ['config', 'modules', 'cpusets', 'hugepages', 'sysfs']), i)
+            outcome = self._outcome()
+            if outcome == 'FAIL':
+                yield 'cat: /sys/kernel/debug/tracing/trace: No such file or directory\n'
+            yield '%s: %s\n' % (outcome, test)
+
+    def _generic_tests(self, name, n_tests):
+        for i in range(n_tests):
+            outcome = self._outcome()
+            if self.random.random() < 0.5:
+                result = '%s: %s %d - %s case %d' % (outcome, name, i, name, i)
+            else:
+                result = '%s: %s-test-%d' % (outcome, name, i)
+            if outcome == 'FAIL':
+                yield '%s: line %d: unexpected output\n' % (name, i)
+            yield self._colour(result + '\n')
+
+    def suite(self, name, tests, n_tests):
+        """Yields the lines of one ptest-runner BEGIN..END (or TIMEOUT)
+        block, with the timestamps around it.
+        """
+        path = '/usr/lib/%s/ptest' % name
+        yield self._timestamp(self.random.randrange(1, 60), False)
+        yield 'BEGIN: %s\n' % path
+        yield from tests(name, n_tests)
+        if self.random.random() < self.timeout_rate:
+            yield 'TIMEOUT: %s\n' % path
+        else:
+            yield 'END: %s\n' % path
+        yield self._timestamp(self.random.randrange(1, 600))
+
+    def runner(self, budget=None):
+        """Yields the lines of a ptest-runner segment over every suite, which
+        stops early once it has yielded `budget` bytes.
+        """
+        yield 'root@nilrt:~# ptest-runner\n'
+        yield 'START: ptest-runner\n'
+        n_bytes = 0
+        for name, tests, n_tests in self.suite_generators:
+            n_tests = max(1, int(n_tests * (0.5 + self.random.random())))
+            for line in self.suite(name, tests, n_tests):
+                n_bytes += len(line)
+                yield line
+            if budget is not None and n_bytes >= budget:
+                break
+        yield 'STOP: ptest-runner\n'
+
+    def lines(self, size):
+        """Yields the lines of a console of about `size` bytes: boot noise
+        followed by as many ptest-runner segments as it takes.
+        """
+        n_bytes = 0
+        while n_bytes < size:
+            for line in self.boot_noise(self.random.randrange(20, 200)):
+                n_bytes += len(line)
+                yield line
+            for line in self.runner(size - n_bytes):
+                n_bytes += len(line)
+                yield line
+
+    def write(self, fp, size):
+        """Writes a console of about `size` bytes to the text stream `fp`,
+        and returns the number of characters written.
+        """
+        n_chars = 0
+        chunk = []
+        for line in self.lines(size):
+            chunk.append(line)
+            if len(chunk) >= 4096:
+                n_chars += fp.write(''.join(chunk))
+                chunk = []
+        n_chars += fp.write(''.join(chunk))
+        return n_chars
+
+    def write_file(self, filepath, size):
+        with open(filepath, 'w', encoding='utf-8', newline='') as fp:
+            return self.write(fp, size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='Random seed of the generator.')
+    parser.add_argument('-s', '--size', action='store', type=parse_size,
+                        default=parse_size('1M'),
+                        help='Approximate size of the console (eg. 512K, 16M).')
+    parser.add_argument('--timeout-rate', action='store', type=float,
+                        default=0.05,
+                        help='Fraction of the suites which time out.')
+    parser.add_argument('output_file', action='store',
+                        help="Console file to write, or '-' for stdout.")
+    args = parser.parse_args()
+
+    generator = ConsoleGenerator(args.seed, timeout_rate=args.timeout_rate)
+    if args.output_file == '-':
+        generator.write(sys.stdout, args.size)
+    else:
+        generator.write_file(args.output_file, args.size)
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
+import fcntl
+import hashlib
+import heapq
 import http.server
+import io
+import json
 import multiprocessing as mp
 import os
 import pexpect
+import posixpath
 import re
 import shutil
 import socket
@@ -12,12 +18,195 @@ import sys
 import tempfile
 import threading
 import zipfile
+import time
 from time import sleep
 from types import SimpleNamespace
 from pprint import pprint
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http import HTTPStatus
+from http.server import HTTPServer, SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 import libytest.parse_console
+from libytest.history import HistoryStore, quantile
+from libytest.parse_console import LiveConsoleParser
+
+
+class FeedServerStats():
+    """Thread-safe byte and latency counters of a feed server's requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record(self, bytes_sent, latency):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += bytes_sent
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def __str__(self):
+        with self._lock:
+            mean = self.latency_total / self.requests if self.requests else 0
+            return '%d requests, %d bytes sent, latency mean %.1f ms, max %.1f ms' % \
+                (self.requests, self.bytes_sent, mean * 1000,
+                 self.latency_max * 1000)
+
+
+class FeedIndexCache():
+    """An in-memory cache of the feed's package index files, which every
+    child downloads on `opkg update`. Entries are revalidated against the
+    file's mtime and size on each request.
+    """
+
+    INDEX_NAMES = ('Packages', 'Packages.gz', 'Packages.sig', 'Packages.stamps')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @classmethod
+    def is_index(cls, path):
+        return os.path.basename(path) in cls.INDEX_NAMES
+
+    def get(self, path):
+        """Returns a tuple of (stat, content) for the index file at `path`.
+        Raises OSError if it cannot be read.
+        """
+        fs = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == (fs.st_mtime_ns, fs.st_size):
+            return fs, entry[1]
+        with open(path, 'rb') as fp:
+            fs = os.fstat(fp.fileno())
+            content = fp.read()
+        with self._lock:
+            self._entries[path] = ((fs.st_mtime_ns, fs.st_size), content)
+        return fs, content
+
+
+class FeedHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = FeedServerStats()
+        self.index_cache = FeedIndexCache()
+
+
+class FeedRequestHandler(SimpleHTTPRequestHandler):
+    """Serves the ipk feed over persistent (HTTP/1.1) connections. File bodies
+    are sent with `sendfile`, single byte ranges are supported, and the
+    package index files are served from a FeedIndexCache.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    RE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    def do_GET(self):
+        self._timed(super().do_GET)
+
+    def do_HEAD(self):
+        self._timed(super().do_HEAD)
+
+    def _timed(self, do_method):
+        t_start = time.monotonic()
+        self._bytes_sent = 0
+        self._status = '-'
+        do_method()
+        latency = time.monotonic() - t_start
+        self.server.stats.record(self._bytes_sent, latency)
+        self.log_message('"%s" %s %d bytes %.1f ms', self.requestline,
+                         self._status, self._bytes_sent, latency * 1000)
+
+    def log_request(self, code='-', size='-'):
+        # requests are logged with their counters, once they are complete
+        self._status = code.value if isinstance(code, HTTPStatus) else code
+
+    def send_head(self):
+        self._range = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or path.endswith('/'):
+            return super().send_head()
+
+        if 'Range' not in self.headers and not FeedIndexCache.is_index(path):
+            return super().send_head()
+
+        try:
+            if FeedIndexCache.is_index(path):
+                fs, content = self.server.index_cache.get(path)
+                f = io.BytesIO(content)
+            else:
+                f = open(path, 'rb')
+                fs = os.fstat(f.fileno())
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        size = fs.st_size
+        byte_range = self._parse_range(size)
+        if byte_range is False:
+            f.close()
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", "bytes */%d" % size)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        if byte_range is None:
+            self.send_response(HTTPStatus.OK)
+            length = size
+        else:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", "bytes %d-%d/%d" %
+                             (start, end, size))
+            length = end - start + 1
+            self._range = (start, length)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified",
+                         self.date_time_string(fs.st_mtime))
+        self.end_headers()
+        return f
+
+    def _parse_range(self, size):
+        """Returns the (first, last) byte positions of the request's Range,
+        None to send the whole file, or False if the range cannot be
+        satisfied. Only single ranges are supported; others are ignored.
+        """
+        match = self.RE_RANGE.match(self.headers.get('Range', '').strip())
+        if match is None:
+            return None
+        first, last = match.groups()
+        if first == '':
+            if last == '':
+                return None
+            # suffix range: the last N bytes
+            first = max(0, size - int(last))
+            last = size - 1
+        else:
+            first = int(first)
+            last = min(int(last), size - 1) if last != '' else size - 1
+        if first > last or first >= size:
+            return False
+        return first, last
+
+    def copyfile(self, source, outputfile):
+        offset, count = self._range if self._range is not None else (0, None)
+        if isinstance(source, io.BytesIO):
+            data = source.getbuffer()[offset:]
+            if count is not None:
+                data = data[:count]
+            outputfile.write(data)
+            self._bytes_sent += len(data)
+            return
+        self._bytes_sent += self.connection.sendfile(source, offset, count)
 
 
 class NILRTFeedServerDaemon(mp.Process):
@@ -55,7 +244,8 @@ class NILRTFeedServerDaemon(mp.Process):
         self._feed_thread = self
 
         # Create HTTP Server instance
-        self._server = HTTPServer((self.bind_address, self.server_port), SimpleHTTPRequestHandler)
+        self._server = FeedHTTPServer((self.bind_address, self.server_port),
+                                      FeedRequestHandler)
         self._ev_run_server.set()
 
         # Start the server in its own thread (so that shutdown works.)
@@ -68,17 +258,143 @@ class NILRTFeedServerDaemon(mp.Process):
         while self._ev_run_server.is_set():
             sleep(2)
         self._server.shutdown()
+        print('Feed server: %s' % self._server.stats)
 
     def stop(self):
         print('Stopping feed server...')
         self._ev_run_server.clear()
 
 
+class TeeLogfile():
+    """A pexpect logfile which writes the child's output to a file (if a path
+    is given) and also feeds it to a LiveConsoleParser, as it arrives.
+
+    If the live parser fails, live parsing stops (`live_parser` is None) but
+    the file is still written, so that it can be parsed after the run.
+    """
+
+    def __init__(self, path, live_parser):
+        self.fp = open(path, 'wb') if path is not None else None
+        self.live_parser = live_parser
+
+    def write(self, data):
+        if self.fp is not None:
+            self.fp.write(data)
+        if self.live_parser is None:
+            return
+        # this runs in pexpect's read path; a parser error must not abort
+        # the child
+        try:
+            self.live_parser.feed(data)
+        except Exception as e:
+            print('Live console parsing failed, the log will be parsed after'
+                  ' the run: %r' % e)
+            self.live_parser = None
+
+    def flush(self):
+        if self.fp is not None:
+            self.fp.flush()
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+def vm_variant(guest_cpus, guest_memory):
+    """Returns the history variant of results from a VM of this size."""
+    return 'cpus=%d,mem=%d' % (guest_cpus, guest_memory)
+
+
+class PtestTimeoutPolicy():
+    """Chooses the deadline of each ptest-runner command from the past
+    durations of its suites on VMs of the same size: the `q` quantile of the
+    durations, times `margin`. Without enough history for this VM size, the
+    durations on other sizes are used, scaled up if this VM has fewer CPUs
+    than the reference; and without any history, the default timeouts are
+    scaled in the same way.
+
+    Commands which exceed their deadline are recorded as overruns, in the
+    history database if there is one.
+    """
+
+    DEFAULT_SUITE_TIMEOUT = 300
+    DEFAULT_RUN_TIMEOUT = 900
+    REFERENCE_CPUS = 4
+
+    def __init__(self, guest_cpus, variant='', history=None, q=0.99,
+                 margin=2.0, minimum=60, min_samples=3):
+        self.guest_cpus = guest_cpus
+        self.variant = variant
+        self.q = q
+        self.margin = margin
+        self.minimum = minimum
+        self.min_samples = min_samples
+        self.history = HistoryStore(history) if history is not None else None
+        self.overruns = []  # list of (suite, timeout) tuples
+
+    @property
+    def cpu_scale(self):
+        return max(1.0, self.REFERENCE_CPUS / self.guest_cpus)
+
+    def _expected_duration(self, suite):
+        """Returns the `q` quantile duration of `suite`, or None."""
+        if self.history is None:
+            return None
+        durations = self.history.suite_durations(suite, variant=self.variant)
+        if len(durations) >= self.min_samples:
+            return quantile(durations, self.q)
+        durations = self.history.suite_durations(suite)
+        if len(durations) >= self.min_samples:
+            return quantile(durations, self.q) * self.cpu_scale
+        return None
+
+    def suite_timeout(self, suite):
+        expected = self._expected_duration(suite)
+        if expected is None:
+            return self.DEFAULT_SUITE_TIMEOUT * self.cpu_scale
+        return max(self.minimum, expected * self.margin)
+
+    def run_timeout(self, suites):
+        """Returns the deadline of a single ptest-runner command which runs
+        each of `suites`: the sum of their expected durations, times
+        `margin`, with the default suite timeout for those without history.
+        """
+        if not suites:
+            # nothing is known about what will run
+            return self.DEFAULT_RUN_TIMEOUT * self.cpu_scale
+        total = 0
+        for suite in suites:
+            expected = self._expected_duration(suite)
+            if expected is None:
+                total += self.DEFAULT_SUITE_TIMEOUT * self.cpu_scale
+            else:
+                total += expected * self.margin
+        return max(self.minimum, total)
+
+    def record_overrun(self, suite, timeout):
+        print('Timeout: ptest %s did not finish within %d seconds.' %
+              (suite or '(all)', timeout))
+        self.overruns.append((suite, timeout))
+        if self.history is not None:
+            self.history.record_timeout_overrun(suite or '*', timeout,
+                                                self.variant)
+
+    def close(self):
+        if self.history is not None:
+            self.history.close()
+            self.history = None
+
+
 class NILRTPtestChild():
 
     PTEST_FEED_DEVICE_ID = 'ptf'
     PTEST_FEED_NET = '10.0.2.0/24'
     PTEST_FEED_HOST_IPV4 = '10.0.2.2'
+    # the user-net subnet of child `net_index` is 10.0.<base + net_index>.0/24
+    PTEST_FEED_NET_FMT = '10.0.%d.0/24'
+    PTEST_FEED_HOST_IPV4_FMT = '10.0.%d.2'
+    PTEST_FEED_NET_BASE = 2
     CHILD_TIMEOUT=30
 
     RE_LOGIN_PASSWORD    = re.compile(b'Password: ')
@@ -87,17 +403,39 @@ class NILRTPtestChild():
     RE_PASSWD_NIAUTH_NEW = re.compile(b'(Re-enter|Enter) new NIAuth password: ')
     RE_PASSWD_NIAUTH_OLD = re.compile(b'Enter current NIAuth password: ')
     RE_PSTTY             = re.compile(b'(\(safemode\) )?\S+@\S+:.*# ')
+    RE_PTEST_LIST_ENTRY  = re.compile(r'^(\S+)\s+(/\S+)$')
 
     def  __init__(self, spawn_script, guest_cpus=4, guest_memory=4096,
-                  logfile=None):
+                  logfile=None, live_results=True, name=None, net_index=0,
+                  timeout_policy=None, snapshot=True):
+        self.name = name
+        if timeout_policy is None:
+            timeout_policy = PtestTimeoutPolicy(guest_cpus,
+                                vm_variant(guest_cpus, guest_memory))
+        self.timeout_policy = timeout_policy
+        if net_index == 0:
+            self.feed_net = self.PTEST_FEED_NET
+            self.feed_host = self.PTEST_FEED_HOST_IPV4
+        else:
+            octet = self.PTEST_FEED_NET_BASE + net_index
+            self.feed_net = self.PTEST_FEED_NET_FMT % octet
+            self.feed_host = self.PTEST_FEED_HOST_IPV4_FMT % octet
         self.__init_qemu_args()
 
         # spawn pexpect child process
-        script_args = ['-s', '-c', str(guest_cpus), '-m', str(guest_memory),
-                       '--']
-        if logfile is not None:
+        # in snapshot mode, no changes are written to the VM's disk
+        script_args = ['-s'] if snapshot else []
+        script_args += ['-c', str(guest_cpus), '-m', str(guest_memory), '--']
+        # per-suite pass (True) or fail (False), as each ptest suite ends
+        self.suite_results = {}
+        if live_results:
+            self.live_parser = LiveConsoleParser(on_suite=self._on_suite)
+            self.logfile = TeeLogfile(logfile, self.live_parser)
+        elif logfile is not None:
+            self.live_parser = None
             self.logfile = open(logfile, 'wb')
         else:
+            self.live_parser = None
             self.logfile = None
         self.child = pexpect.spawn(spawn_script,
                         args=script_args + self.qemu_args,
@@ -108,12 +446,41 @@ class NILRTPtestChild():
         if self.logfile is not None:
             self.logfile.close()
 
+    def _on_suite(self, e_suite):
+        e_suite.eval_counts()
+        passed = (e_suite.get('errors') + e_suite.get('failures')) == 0
+        self.suite_results[e_suite.get('name')] = passed
+        prefix = '[%s] ' % self.name if self.name else ''
+        print('\n%sptest %s: %s [ %s ]' % (prefix, e_suite.get('name'),
+              'PASS' if passed else 'FAIL', e_suite.get_digest()))
+
+    def close_results(self):
+        """Closes the child's log and returns the TestSuites parsed from it,
+        or None if the child's output was not parsed live (or live parsing
+        failed), in which case the log has to be parsed instead.
+        """
+        if self.logfile is not None:
+            self.logfile.close()
+        self.timeout_policy.close()
+        if self.live_parser is None or self.logfile.live_parser is None:
+            return None
+        try:
+            return self.live_parser.close()
+        except Exception as e:
+            print('Live console parsing failed, the log will be parsed after'
+                  ' the run: %r' % e)
+            return None
+
+    def terminate(self):
+        """Kills the VM process, if it is still running, and closes its pty."""
+        self.child.close(force=True)
+
     def __init_qemu_args(self):
         args = []
         args.append('-netdev user,id=%s,net=%s,host=%s' % \
                 (self.PTEST_FEED_DEVICE_ID,
-                 self.PTEST_FEED_NET,
-                 self.PTEST_FEED_HOST_IPV4))
+                 self.feed_net,
+                 self.feed_host))
         args.append('-device e1000,netdev=%s' % self.PTEST_FEED_DEVICE_ID)
         self.qemu_args = args
 
@@ -143,18 +510,50 @@ class NILRTPtestChild():
         return self.sh_command(cmd)
 
     def run_ptest_suite(self, *args):
+        policy = self.timeout_policy
         if len(args) == 0:
-            self.sh_command('ptest-runner', timeout=900)
+            # the deadline only covers the suites on this VM
+            self._run_ptest_runner('ptest-runner', None,
+                policy.run_timeout(self.list_ptest_suites()))
         else:
             for arg in args:
-                self.sh_command('ptest-runner %s' % arg, timeout=300)
+                self._run_ptest_runner('ptest-runner %s' % arg, arg,
+                                       policy.suite_timeout(arg))
+
+    def _run_ptest_runner(self, cmd, suite, timeout):
+        try:
+            self.sh_command(cmd, timeout=timeout)
+        except pexpect.exceptions.TIMEOUT:
+            self.timeout_policy.record_overrun(suite, timeout)
+            raise
+
+    def list_ptest_suites(self):
+        """Returns the names of the ptest suites installed on the VM."""
+        output = self.sh_command('ptest-runner -l')
+        suites = []
+        for line in output.decode('utf-8', 'replace').splitlines():
+            match = self.RE_PTEST_LIST_ENTRY.match(line.strip())
+            if match:
+                suites.append(match.group(1))
+        return suites
 
     def setup_ptest_feeds(self, feed_port):
         self.sh_command('rm -fv /etc/opkg/opkg-signing.conf')
-        self.sh_command("sed -i 's/http:\/\/.*\/feeds\/\w\+\/x64/http:\/\/%s:%s/' /etc/opkg/base-feeds.conf" % (self.PTEST_FEED_HOST_IPV4, feed_port))
+        self.sh_command("sed -i 's/http:\/\/.*\/feeds\/\w\+\/x64/http:\/\/%s:%s/' /etc/opkg/base-feeds.conf" % (self.feed_host, feed_port))
         self.opkg_install('packagegroup-ni-ptest-smoke', update=True)
         self.sh_command('ptest-runner -l')
 
+    def retarget_ptest_feeds(self, feed_port):
+        """Points feeds which were set up by `setup_ptest_feeds()` (possibly
+        on another child, with another user-net subnet) at this child's feed
+        host.
+        """
+        self.sh_command("sed -i 's/http:\/\/[0-9.]\+:%s/http:\/\/%s:%s/' /etc/opkg/base-feeds.conf" % (feed_port, self.feed_host, feed_port))
+
+    def wait_exit(self, timeout=300):
+        """Waits for the VM process to exit, after a shutdown."""
+        self.child.expect(pexpect.EOF, timeout=timeout)
+
     def sh_command(self, cmd, timeout=30):
         """
         Run cmd on vm and verify if output_test_str is in the cmd output
@@ -181,7 +580,12 @@ def create_results_dir(path):
     os.makedirs(realpath, exist_ok=True)
     return realpath
 
-def junit_parse_log(logfile):
+def junit_parse_log(logfile, e_suites=None, history=None, variant=''):
+    """Writes the junit results of the console in `logfile`. If the console
+    has already been parsed (live), its `e_suites` are written directly. If a
+    `history` database is given, the results are recorded in it under
+    `variant`.
+    """
     # name the output file the same as the logfile, but with a '.xml' extension
     outfile = os.path.join(os.path.dirname(logfile),
                   os.path.splitext(os.path.basename(logfile))[0] + '.xml')
@@ -192,15 +596,67 @@ def junit_parse_log(logfile):
         'verbose_output': True,
         'console_file': [logfile],
         'output_file': outfile,
+        'history': history,
+        'history_variant': variant,
         })
     pprint(parser_args)
     log_parser = libytest.parse_console.Application(parser_args)
-    log_parser.main()
+    if e_suites is None:
+        e_suites = log_parser.merge_suites(
+            *log_parser.parse_console_files([logfile]))
+    else:
+        log_parser.add_console_name(e_suites, logfile)
+    log_parser.report(e_suites)
+    return e_suites
+
+def junit_write_merged(e_suites_list, outfile, shard_plan=None):
+    """Writes the TestSuites of several children as a single junit run. The
+    shards of a `shard_plan` are merged back into ptest-runner order.
+    """
+    print('outfile=%s' % outfile)
+    parser_args = SimpleNamespace(**{
+        'mask_file': None,
+        'verbose': False,
+        'verbose_output': True,
+        'output_file': outfile,
+        })
+    log_parser = libytest.parse_console.Application(parser_args)
+    if shard_plan is not None:
+        e_suites = shard_plan.merge(e_suites_list)
+    else:
+        e_suites = log_parser.merge_suites(*e_suites_list)
+    log_parser.write_xml(e_suites)
 
 def test_nilrt_ptest(start_script, feed_server_port, guest_cpus, guest_memory,
-                    logfile, suites=[]):
-    child = NILRTPtestChild(start_script, guest_cpus=guest_cpus,
-                guest_memory=guest_memory, logfile=logfile)
+                    logfile, suites=[], name=None, net_index=0, shard=None,
+                    suite_durations=None, history=None, prepared=False):
+    """Runs the ptests on a new VM child. If a `shard` tuple of
+    (PtestShardPlan, shard index) is given, only the suites of that shard are
+    run. If a `suite_durations` dict is given, it is updated with the wall
+    time of each suite which ran. The timeouts of the suites are chosen from
+    their durations in the `history` database, if one is given.
+
+    If `prepared`, `start_script` boots a VM whose disk is a copy-on-write
+    overlay of a prepared base (see NILRTVMOverlays), on which the ptest
+    feeds are already set up.
+
+    The VM is always terminated before this returns, whether or not the run
+    completed.
+
+    Returns: tuple of (True if the run completed, TestSuites parsed live
+        from the child's console, so far)
+    """
+    timeout_policy = PtestTimeoutPolicy(guest_cpus,
+        vm_variant(guest_cpus, guest_memory), history=history)
+    try:
+        child = NILRTPtestChild(start_script, guest_cpus=guest_cpus,
+                    guest_memory=guest_memory, logfile=logfile, name=name,
+                    net_index=net_index, timeout_policy=timeout_policy,
+                    snapshot=not prepared)
+    except BaseException:
+        # the child's close_results() would have closed it
+        timeout_policy.close()
+        raise
 
     try:
         child.login('root', '')
@@ -208,21 +664,538 @@ def test_nilrt_ptest(start_script, feed_server_port, guest_cpus, guest_memory,
         child.sh_command('ip route')
         child.sh_command('ip a')
 
-        child.setup_ptest_feeds(feed_server_port)
-        child.run_ptest_suite(*suites)
+        if prepared:
+            child.retarget_ptest_feeds(feed_server_port)
+        else:
+            child.setup_ptest_feeds(feed_server_port)
+        if shard is not None:
+            plan, index = shard
+            suites = plan.get_shard(index, child)
+            print('Test child %s runs shard %d: %s' %
+                  (name, index, ' '.join(suites)))
+        # an empty shard runs nothing (no arguments would run every suite)
+        if shard is None or suites:
+            child.run_ptest_suite(*suites)
         child.shutdown()
     except pexpect.exceptions.TIMEOUT as e:
         print(e)
-        return False
+        completed = False
+    except Exception as e:
+        print('Test child %s failed: %r' % (name, e))
+        completed = False
     else:
-        return True
+        completed = True
+    finally:
+        # never leave a VM running, even if the run was interrupted
+        child.terminate()
+        e_suites = child.close_results()
+        if suite_durations is not None and child.live_parser is not None:
+            suite_durations.update(child.live_parser.suite_durations)
+    return completed, e_suites
+
+def load_suite_durations(path):
+    """Returns the {suite name: seconds} durations of past runs, from the
+    JSON file at `path`; empty if there is none.
+    """
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+def save_suite_durations(path, durations):
+    """Merges `durations` into the JSON durations file at `path`."""
+    merged = load_suite_durations(path)
+    merged.update(durations)
+    path_tmp = path + '.tmp'
+    with open(path_tmp, 'w') as fp:
+        json.dump(merged, fp, indent=1, sort_keys=True)
+    os.replace(path_tmp, path)
+
+def lpt_schedule(suites, durations, n_shards):
+    """Splits `suites` into `n_shards` lists, by a longest-processing-time
+    first schedule of their `durations`. Suites without a known duration are
+    assumed to take the median of the known durations.
+
+    Returns: list of `n_shards` suite lists, each in its original `suites`
+        order.
+    """
+    known = sorted(durations[s] for s in suites if s in durations)
+    default = known[len(known) // 2] if known else 1
+    order = {suite: i for i, suite in enumerate(suites)}
+    by_duration = sorted(suites, key=lambda s: (-durations.get(s, default),
+                                                order[s]))
+
+    shards = [[] for _ in range(n_shards)]
+    loads = [(0, i) for i in range(n_shards)]  # heap of (load, shard index)
+    for suite in by_duration:
+        load, i = heapq.heappop(loads)
+        shards[i].append(suite)
+        heapq.heappush(loads, (load + durations.get(suite, default), i))
+    return [sorted(shard, key=order.get) for shard in shards]
+
+
+class PtestShardPlan():
+    """Splits the ptest suites of a VM image into shards, one for each of
+    `n_shards` children. The first child to get its shard lists the suites
+    installed on its VM; the others wait for that listing.
+    """
+
+    def __init__(self, n_shards, durations):
+        self.n_shards = n_shards
+        self.durations = durations
+        self.suites = None
+        self.shards = None
+        self._lock = threading.Lock()
+
+    def get_shard(self, index, child):
+        with self._lock:
+            if self.shards is None:
+                self.suites = child.list_ptest_suites()
+                self.shards = lpt_schedule(self.suites, self.durations,
+                                           self.n_shards)
+            return self.shards[index]
+
+    def merge(self, e_suites_list):
+        """Merges the TestSuites of every shard into one, with the ptest
+        suites in their `ptest-runner -l` order, followed by the console
+        suites of each shard.
+        """
+        order = {suite: i for i, suite in enumerate(self.suites or [])}
+        e_ptests = []
+        e_others = []
+        for e_suites in e_suites_list:
+            if e_suites is None:
+                continue
+            for e_suite in e_suites.test_suites:
+                if e_suite.get('name') in order:
+                    e_ptests.append(e_suite)
+                else:
+                    e_others.append(e_suite)
+        e_ptests.sort(key=lambda e_suite: order[e_suite.get('name')])
+        e_ret = libytest.libytest.TestSuites()
+        e_ret.test_suites.extend(e_ptests + e_others)
+        return e_ret
+
+def host_memory_available():
+    """Returns the host memory which is available for new VMs, in MiB."""
+    try:
+        with open('/proc/meminfo', 'r') as fp_meminfo:
+            for line in fp_meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES') \
+        // (1024 * 1024)
+
+
+def default_vm_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'nilrt-ptest', 'vm')
+
+
+class VMBundleCache():
+    """A cache of the disk images of zipped VM bundles, keyed by the SHA-256
+    of the archive.
+
+    Only the disk image is cached, read-only; it is extracted once per
+    archive and the other (small) files of the VM directory are extracted
+    afresh for every run, so that state which the VM writes back, like its
+    UEFI variables, never leaks between runs. Archive digests are memoized
+    by path, size and mtime, so that an unchanged archive is not re-hashed
+    either. At most `keep` disk images are kept, least-recently used first
+    out.
+
+    The cache may be shared by concurrent harnesses. A harness holds a
+    shared lock on the entry of each disk it has handed out, until it is
+    closed (or exits), and entries which are locked are never evicted.
+    """
+
+    DIGEST_INDEX = 'digests.json'
+    ENTRY_LOCK = '.in-use'
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, cache_dir, keep=2):
+        self.cache_dir = cache_dir
+        self.keep = keep
+        # shared locks of the entries in use by this harness
+        self._in_use = []
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def close(self):
+        """Releases the entries of the disks handed out by this cache."""
+        for fp_lock in self._in_use:
+            fp_lock.close()
+        self._in_use = []
+
+    def _lock(self):
+        # serializes extraction and eviction between concurrent harnesses
+        fp_lock = open(os.path.join(self.cache_dir, '.lock'), 'w')
+        fcntl.flock(fp_lock, fcntl.LOCK_EX)
+        return fp_lock
+
+    def _open_entry_lock(self, entry_dir):
+        return open(os.path.join(entry_dir, self.ENTRY_LOCK), 'a')
+
+    def _use_entry(self, entry_dir):
+        # taken under the cache lock, so that no eviction can come between
+        # finding the disk and marking its entry as in use
+        fp_lock = self._open_entry_lock(entry_dir)
+        fcntl.flock(fp_lock, fcntl.LOCK_SH)
+        self._in_use.append(fp_lock)
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.DIGEST_INDEX)) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        path = os.path.join(self.cache_dir, self.DIGEST_INDEX)
+        path_tmp = path + '.tmp'
+        with open(path_tmp, 'w') as fp:
+            json.dump(index, fp, indent=1, sort_keys=True)
+        os.replace(path_tmp, path)
+
+    def archive_digest(self, zip_path):
+        """Returns the SHA-256 hexdigest of the archive at `zip_path`."""
+        zip_path = os.path.realpath(zip_path)
+        st = os.stat(zip_path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        index = self._load_index()
+        entry = index.get(zip_path)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+
+        h = hashlib.sha256()
+        with open(zip_path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(self.CHUNK_SIZE), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock():
+            index = self._load_index()
+            index[zip_path] = stamp + [digest]
+            self._save_index(index)
+        return digest
+
+    @staticmethod
+    def find_disk_member(zip_vm):
+        """Returns the ZipInfo of the first qcow2 disk in `zip_vm`, or None.
+        Only the central directory of the archive is read.
+        """
+        for info in zip_vm.infolist():
+            if not info.is_dir() and \
+               os.path.splitext(info.filename)[1] == '.qcow2':
+                return info
+        return None
+
+    def get_disk(self, zip_vm, info, digest):
+        """Returns the path of the cached disk `info` of `zip_vm`, extracting
+        it if it is not cached yet.
+        """
+        entry_dir = os.path.join(self.cache_dir, digest)
+        disk = os.path.join(entry_dir, os.path.basename(info.filename))
+        with self._lock():
+            try:
+                if os.path.getsize(disk) == info.file_size:
+                    os.utime(entry_dir)
+                    self._use_entry(entry_dir)
+                    return disk
+            except FileNotFoundError:
+                pass
+
+            print('Extracting %s to the VM cache: %s' % (info.filename, disk))
+            os.makedirs(entry_dir, exist_ok=True)
+            fd, disk_tmp = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp_disk, \
+                     zip_vm.open(info) as fp_member:
+                    shutil.copyfileobj(fp_member, fp_disk, self.CHUNK_SIZE)
+                # the children only ever boot snapshots or overlays of it
+                os.chmod(disk_tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(disk_tmp, disk)
+            except BaseException:
+                if os.path.exists(disk_tmp):
+                    os.remove(disk_tmp)
+                raise
+            os.utime(entry_dir)
+            self._use_entry(entry_dir)
+            self._evict(keep_dir=entry_dir)
+        return disk
+
+    def _evict(self, keep_dir):
+        entries = []
+        for dirent in os.scandir(self.cache_dir):
+            if dirent.is_dir(follow_symlinks=False) and dirent.path != keep_dir:
+                entries.append((dirent.stat().st_mtime, dirent.path))
+        entries.sort(reverse=True)
+        for _, path in entries[max(self.keep - 1, 0):]:
+            try:
+                fp_lock = self._open_entry_lock(path)
+            except FileNotFoundError:
+                continue
+            with fp_lock:
+                try:
+                    fcntl.flock(fp_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    print('Not evicting from the VM cache, in use: %s' % path)
+                    continue
+                print('Evicting from the VM cache: %s' % path)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def extract_vm_dir(self, zip_path, dest_dir):
+        """Extracts the VM directory of the bundle `zip_path` (the archive
+        directory which holds its qcow2 disk) under `dest_dir`, linking to
+        the cached disk instead of extracting it.
+
+        Returns: the path of the VM directory
+        """
+        digest = self.archive_digest(zip_path)
+        with zipfile.ZipFile(zip_path) as zip_vm:
+            info = self.find_disk_member(zip_vm)
+            if info is None:
+                raise FileNotFoundError('no qcow2 disk in %s' % zip_path)
+            disk = self.get_disk(zip_vm, info, digest)
+
+            prefix = posixpath.dirname(info.filename)
+            vm_dir = os.path.normpath(os.path.join(dest_dir, prefix))
+            if os.path.commonpath([dest_dir, vm_dir]) != dest_dir:
+                raise ValueError('unsafe disk path in %s: %s' %
+                                 (zip_path, info.filename))
+            os.makedirs(vm_dir, exist_ok=True)
+            if prefix:
+                prefix += '/'
+            for member in zip_vm.infolist():
+                if member is info or not member.filename.startswith(prefix):
+                    continue
+                zip_vm.extract(member, dest_dir)
+        os.symlink(disk, os.path.join(vm_dir, os.path.basename(info.filename)))
+
+        # make any scripts in the vm_dir executable for pexpect
+        for fil in os.listdir(vm_dir):
+            if os.path.splitext(fil)[1] == '.sh':
+                sc_path = os.path.join(vm_dir, fil)
+                mode = os.stat(sc_path).st_mode
+                os.chmod(sc_path, mode | stat.S_IRWXU)
+        return vm_dir
+
+
+class NILRTVMOverlays():
+    """Copy-on-write views of a VM directory, so that several children can
+    boot the same VM image at once without the `-s` (snapshot) mode.
+
+    Every view is a new directory under `work_dir` which links to the files
+    of `vm_dir`, except for the VM's disk, which is a qcow2 overlay of a
+    backing disk, and for its UEFI variable stores, which are copied. The
+    start scripts find their disk and firmware relative to their own path.
+
+    `prepare_base()` boots the image once, to set up the ptest feeds, on an
+    overlay of the original disk; the children are then started from
+    overlays of that prepared base.
+    """
+
+    def __init__(self, vm_dir, start_script_name, work_dir):
+        self.vm_dir = os.path.realpath(vm_dir)
+        self.start_script_name = start_script_name
+        self.work_dir = work_dir
+        self.disk_name = None
+        for fil in sorted(os.listdir(self.vm_dir)):
+            if os.path.splitext(fil)[1] == '.qcow2':
+                self.disk_name = fil
+                break
+        if self.disk_name is None:
+            raise FileNotFoundError('no qcow2 disk in %s' % vm_dir)
+        self.base_disk = os.path.join(self.vm_dir, self.disk_name)
+
+    @staticmethod
+    def create_overlay(path, backing_disk):
+        sp.run(['qemu-img', 'create', '-q', '-f', 'qcow2',
+                '-b', os.path.realpath(backing_disk), '-F', 'qcow2', path],
+               check=True)
+
+    def _mirror(self, src_dir, dst_dir, backing_disk):
+        os.makedirs(dst_dir)
+        for fil in os.listdir(src_dir):
+            src = os.path.join(src_dir, fil)
+            dst = os.path.join(dst_dir, fil)
+            if src_dir == self.vm_dir and fil == self.disk_name:
+                self.create_overlay(dst, backing_disk)
+            elif os.path.isdir(src) and not os.path.islink(src):
+                self._mirror(src, dst, backing_disk)
+            elif 'VARS' in fil:
+                # writable UEFI pflash; every VM needs its own
+                shutil.copy2(src, dst)
+            else:
+                os.symlink(src, dst)
+
+    def make_vm_dir(self, name, backing_disk):
+        """Returns a new VM directory, whose disk is an overlay of
+        `backing_disk`.
+        """
+        vm_dir = os.path.join(self.work_dir, name)
+        self._mirror(self.vm_dir, vm_dir, backing_disk)
+        return vm_dir
+
+    def start_script(self, vm_dir):
+        return os.path.join(vm_dir, self.start_script_name)
+
+    def prepare_base(self, feed_server_port, guest_cpus=4, guest_memory=4096,
+                     logfile=None):
+        """Boots an overlay of the original disk, sets up the ptest feeds
+        and shuts the VM down cleanly. Later VM directories are backed by
+        the resulting disk.
+        """
+        vm_dir = self.make_vm_dir('base', self.base_disk)
+        child = NILRTPtestChild(self.start_script(vm_dir),
+                    guest_cpus=guest_cpus, guest_memory=guest_memory,
+                    logfile=logfile, live_results=False, name='base',
+                    snapshot=False)
+        try:
+            child.login('root', '')
+            child.setup_ptest_feeds(feed_server_port)
+            child.sh_command('sync')
+            child.shutdown()
+            child.wait_exit()
+        finally:
+            child.terminate()
+            child.close_results()
+        self.base_disk = os.path.join(vm_dir, self.disk_name)
+        return self.base_disk
+
+
+class PtestJob():
+    """A ptest run on a single VM child, as scheduled by a PtestScheduler."""
+
+    def __init__(self, name, guest_cpus, guest_memory, logfile, suites=[],
+                 shard=None):
+        self.name = name
+        self.guest_cpus = guest_cpus
+        self.guest_memory = guest_memory
+        self.logfile = logfile
+        self.suites = suites
+        self.shard = shard
+        # set once the job has run
+        self.completed = None
+        self.e_suites = None
+        self.suite_durations = {}
+
+    @property
+    def variant(self):
+        return vm_variant(self.guest_cpus, self.guest_memory)
+
+
+class PtestScheduler():
+    """Runs PtestJobs concurrently, each on its own VM child, admitting a job
+    only while the host has the CPUs and memory for its guest. Jobs are
+    admitted in the order they were added, skipping over those which do not
+    fit yet. A job which is larger than the whole host is run on its own.
+    """
+
+    def __init__(self, start_script, feed_server_port, host_cpus=None,
+                 host_memory=None, max_jobs=None, history=None, overlays=None):
+        self.start_script = start_script
+        self.feed_server_port = feed_server_port
+        self.history = history
+        # if set, each job runs on its own overlay of the prepared base
+        self.overlays = overlays
+        self.host_cpus = host_cpus or os.cpu_count() or 1
+        self.host_memory = host_memory or host_memory_available()
+        self.max_jobs = max_jobs
+        self.jobs = []
+
+    def add_job(self, *args, **kwargs):
+        job = PtestJob(*args, **kwargs)
+        self.jobs.append(job)
+        return job
+
+    def _fits(self, job, running):
+        if not running:
+            return True
+        if self.max_jobs and len(running) >= self.max_jobs:
+            return False
+        cpus = sum(j.guest_cpus for j in running) + job.guest_cpus
+        memory = sum(j.guest_memory for j in running) + job.guest_memory
+        return cpus <= self.host_cpus and memory <= self.host_memory
+
+    def _run_job(self, job, net_index, cv, running):
+        vm_dir = None
+        try:
+            start_script = self.start_script
+            if self.overlays is not None:
+                vm_dir = self.overlays.make_vm_dir(job.name,
+                                                   self.overlays.base_disk)
+                start_script = self.overlays.start_script(vm_dir)
+            print('Starting test child %s. Logging output to: %s' %
+                  (job.name, job.logfile))
+            job.completed, job.e_suites = test_nilrt_ptest(start_script,
+                self.feed_server_port, guest_cpus=job.guest_cpus,
+                guest_memory=job.guest_memory, logfile=job.logfile,
+                suites=job.suites, name=job.name, net_index=net_index,
+                shard=job.shard, suite_durations=job.suite_durations,
+                history=self.history, prepared=self.overlays is not None)
+        except Exception as e:
+            # failures to start the child; test_nilrt_ptest() handles those
+            # of a running child
+            print('Test child %s failed: %s' % (job.name, e))
+            job.completed = False
+        finally:
+            if vm_dir is not None:
+                shutil.rmtree(vm_dir, ignore_errors=True)
+            with cv:
+                running.remove(job)
+                cv.notify_all()
+
+    def run(self):
+        """Runs all of the jobs and returns them, in the order they were
+        added.
+        """
+        pending = list(self.jobs)
+        running = []
+        threads = []
+        cv = threading.Condition()
+        with cv:
+            while pending:
+                for job in pending:
+                    if self._fits(job, running):
+                        break
+                else:
+                    cv.wait()
+                    continue
+                pending.remove(job)
+                running.append(job)
+                # give every child its own user-net subnet
+                thread = threading.Thread(target=self._run_job,
+                    args=(job, self.jobs.index(job), cv, running),
+                    name='ptest-%s' % job.name)
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return self.jobs
+
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
 
     parser = ArgumentParser()
     parser.add_argument('-f', '--feed', nargs=1, action='store', required=True)
+    parser.add_argument('--history', action='store', default=None,
+                        help='SQLite results history; used to choose suite timeouts, and updated after the run.')
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=None,
+                        help='Run at most this many VM children at once (default: as many as the host can afford).')
     parser.add_argument('-n', '--no-junit-parse', action='store_true')
+    parser.add_argument('-p', '--prepare-base', action='store_true',
+                        help='Set up the ptest feeds once, on a base image which the children boot copy-on-write overlays of.')
+    parser.add_argument('-s', '--shards', action='store', type=int, default=0,
+                        help='Split the ptest suites across this many VM children.')
+    parser.add_argument('--durations', action='store', default=None,
+                        help='JSON file of past suite durations on 4 CPU/4096 MiB VMs, used to balance the shards, and updated after the run.')
+    parser.add_argument('--vm-cache', action='store', default=default_vm_cache_dir(),
+                        help='Directory of the disk images extracted from zipped VM bundles (default: %(default)s).')
+    parser.add_argument('--vm-cache-keep', action='store', type=int, default=2,
+                        help='Keep the disk images of at most this many VM bundles in the VM cache.')
     parser.add_argument('run_id')
     parser.add_argument('vm_dir')
     parser.add_argument('test_results_dir', default=".")
@@ -230,29 +1203,17 @@ if __name__ == "__main__":
 
     # create in the main script context so that it will be cleaned up on exit
     vm_dir_temp = None
-    # if the vm_dir is a zipfile, extract it to a tempfile
+    vm_cache = None
+    # if the vm_dir is a zipfile, extract it to a tempfile, with its disk
+    # image linked from the VM cache
     if zipfile.is_zipfile(args.vm_dir):
         vm_dir_temp = tempfile.TemporaryDirectory()
         print('Detected vm_dir as zip file. Extracting to: %s' % vm_dir_temp.name)
-        with zipfile.ZipFile(args.vm_dir) as zip_vm:
-            zip_vm.extractall(path=vm_dir_temp.name)
-        # search for a QEMU qcow disk within the archive
-        found = False
-        for root, dirs, fils in os.walk(vm_dir_temp.name):
-            for fil in fils:
-                if os.path.splitext(fil)[1] == '.qcow2':
-                    args.vm_dir = root
-                    found = True
-                    break
-            if found: break
-        # make any scripts in the vm_dir executable for pexpect
-        if found:
-            for fil in os.listdir(args.vm_dir):
-                if os.path.splitext(fil)[1] == '.sh':
-                    sc_path = os.path.join(args.vm_dir, fil)
-                    mode = os.stat(sc_path).st_mode
-                    os.chmod(sc_path, mode | stat.S_IRWXU)
-        if not found:
+        vm_cache = VMBundleCache(args.vm_cache, keep=args.vm_cache_keep)
+        try:
+            args.vm_dir = vm_cache.extract_vm_dir(args.vm_dir,
+                                                  vm_dir_temp.name)
+        except FileNotFoundError:
             print('ERROR: could not find qcow2 disk in the vm archive.')
             sys.exit(1)
 
@@ -271,29 +1232,69 @@ if __name__ == "__main__":
         feed_server.start()  # start the feed server daemon in a new process
         sleep(3)  # give the feed_server a few seconds to setup and get a port
 
-        # test all suites on a resourceful target
-        child_log = _child_log('%s-max' % args.run_id)
-        print('Starting test child %s. Logging output to: %s' % (args.run_id, child_log))
-        rc = test_nilrt_ptest(child_start_script,
-                feed_server.server_port, guest_cpus=4, guest_memory=4096,
-                logfile=child_log) and rc
-        if not args.no_junit_parse:
-            junit_parse_log(child_log)
+        overlays = None
+        if args.prepare_base:
+            # install the ptests once, on a base which every child overlays
+            overlays_dir = tempfile.TemporaryDirectory()
+            overlays = NILRTVMOverlays(args.vm_dir,
+                                       os.path.basename(child_start_script),
+                                       overlays_dir.name)
+            print('Preparing the ptest base image in: %s' % overlays_dir.name)
+            overlays.prepare_base(feed_server.server_port,
+                                  logfile=_child_log('%s-base' % args.run_id))
+
+        scheduler = PtestScheduler(child_start_script, feed_server.server_port,
+                                   max_jobs=args.jobs, history=args.history,
+                                   overlays=overlays)
+        shard_plan = None
+        # the durations file and the shards are of 4 CPU/4096 MiB VMs
+        shard_variant = vm_variant(4, 4096)
+        if args.shards > 0:
+            # split the suites across resourceful targets, by their durations
+            # in past runs
+            durations = load_suite_durations(args.durations)
+            if args.history is not None:
+                with HistoryStore(args.history) as history:
+                    for suite in history.suites(shard_variant):
+                        durations.setdefault(suite, quantile(
+                            history.suite_durations(suite, shard_variant),
+                            0.5))
+            shard_plan = PtestShardPlan(args.shards, durations)
+            for i in range(args.shards):
+                child_name = '%s-shard%d' % (args.run_id, i)
+                scheduler.add_job(child_name, 4, 4096, _child_log(child_name),
+                                  shard=(shard_plan, i))
+        else:
+            # test all suites on a resourceful target and on a minimal target,
+            # concurrently if the host can afford both
+            scheduler.add_job('%s-max' % args.run_id, 4, 4096,
+                              _child_log('%s-max' % args.run_id))
+            scheduler.add_job('%s-min' % args.run_id, 1, 1024,
+                              _child_log('%s-min' % args.run_id))
+        jobs = scheduler.run()
+
+        if args.durations is not None:
+            # durations on other VM sizes would skew the shards
+            durations = {}
+            for job in jobs:
+                if job.variant == shard_variant:
+                    durations.update(job.suite_durations)
+            save_suite_durations(args.durations, durations)
 
-        # test all suites on a minimal target
-        child_log = _child_log('%s-min' % args.run_id)
+        rc = all(job.completed for job in jobs)
         print('rc=%s' % rc)
-        print('Starting test child %s. Logging output to: %s' % (args.run_id, child_log))
-        rc = test_nilrt_ptest(child_start_script,
-                feed_server.server_port, guest_cpus=1, guest_memory=1024,
-                logfile=child_log) and rc
         if not args.no_junit_parse:
-            print('rc=%s' % rc)
-            junit_parse_log(child_log)
+            e_suites_list = [junit_parse_log(job.logfile, job.e_suites,
+                                             args.history, job.variant)
+                             for job in jobs]
+            junit_write_merged(e_suites_list, os.path.join(
+                args.test_results_dir, '%s.xml' % args.run_id), shard_plan)
     except KeyboardInterrupt:
         pass
     finally:
         feed_server.stop()  # tell the feed server thread to stop
         feed_server.join()
+        if vm_cache is not None:
+            vm_cache.close()
 
         sys.exit(0)  # always exit true if the test completes